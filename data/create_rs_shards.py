@@ -0,0 +1,58 @@
+"""
+Pack RS-GOPRO sequences (RS/, GS/, FL/ image and flow files) into binary shards, see data/rs_shard.py
+    python data/create_rs_shards.py --src RS-GOPRO_DS/train --dst RS-GOPRO_shards/train --codec raw
+"""
+
+import os
+import sys
+import argparse
+from os.path import join
+
+import cv2
+import numpy as np
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from data.rs_shard import ShardWriter
+
+
+def pack_sequence(seq_path, shard_path, codec='raw', chunk_rows=64, chunk_cols=64, flow=True):
+    """
+    Parameters:
+        seq_path: sequence directory with RS/, GS/ and optionally FL/
+        shard_path: shard path without extension
+        codec: 'raw' | 'zlib'
+        chunk_rows, chunk_cols: tile size of compressed arrays
+        flow: whether to pack the flows, stored as float16
+    """
+    rs_files = sorted(os.listdir(join(seq_path, 'RS')))
+    meta = {'seq_num': len(rs_files) // 2}  #include t2b and b2t
+    with ShardWriter(shard_path, codec=codec, chunk_rows=chunk_rows, chunk_cols=chunk_cols, meta=meta) as writer:
+        for sub in ['RS', 'GS']:
+            for name in sorted(os.listdir(join(seq_path, sub))):
+                writer.add('{}/{}'.format(sub, name), cv2.imread(join(seq_path, sub, name)))
+        if flow and os.path.exists(join(seq_path, 'FL')):
+            for name in sorted(os.listdir(join(seq_path, 'FL'))):
+                writer.add('FL/{}'.format(name), np.load(join(seq_path, 'FL', name)).astype(np.float16))
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--src', type=str, required=True, help='RS-GOPRO split directory, e.g. RS-GOPRO_DS/train')
+    parser.add_argument('--dst', type=str, required=True, help='output directory of the shards')
+    parser.add_argument('--codec', type=str, default='raw', choices=['raw', 'zlib'])
+    parser.add_argument('--chunk_rows', type=int, default=64, help='tile rows of compressed arrays')
+    parser.add_argument('--chunk_cols', type=int, default=64, help='tile columns of compressed arrays, 0 for whole rows')
+    parser.add_argument('--no_flow', action='store_true', help='skip the FL flows')
+    args = parser.parse_args()
+
+    os.makedirs(args.dst, exist_ok=True)
+    for seq in sorted(os.listdir(args.src)):
+        if seq.endswith('avi'):
+            continue
+        print('Packing sequence {}'.format(seq))
+        pack_sequence(join(args.src, seq), join(args.dst, seq), args.codec, args.chunk_rows,
+                      args.chunk_cols or None, not args.no_flow)
+
+
+if __name__ == '__main__':
+    main()
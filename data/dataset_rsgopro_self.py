@@ -11,7 +11,7 @@ import cv2
 import numpy as np
 #import mindspore as ms
 #import mindspore.ops as O
-from data.distortion_prior import distortion_map, time_map
+from data.distortion_prior import ref_rows, distortion_map_crop, time_map_crop
 from data.utils import normalize, flow_to_image
 from models.warplayer import warp
 
@@ -20,7 +20,7 @@ class RSGOPRO:
     """ Dataset class for RS-GOPRO"""
 
     def __init__(self, path, future_frames=1, past_frames=1, ext_frames=9, crop_size=256, centralize=False,
-                 normalize=True, flow=False, is_test=False, inference=False):
+                 normalize=True, flow=False, is_test=False, inference=False, crop_grid=1):
         """
         Initialize dataset class
 
@@ -32,6 +32,7 @@ class RSGOPRO:
             crop_size: patch size of random cropping
             centralize: subtract half value range
             normalize: divide value range
+            crop_grid: crop offsets are multiples of it, >1 makes crops repeat across epochs (e.g. for cached teacher outputs)
         """
         #super(RSGOPRO, self).__init__()
         self.H = 540
@@ -39,10 +40,6 @@ class RSGOPRO:
         self.flow = flow
         # assert ext_frames in [1, 3, 5, 9], "ext_frames should be [1 | 3 | 5 | 9]"
         self.ext_frames = 9
-        self.time_encoding = self._gen_time_coding(self.H, self.W, self.ext_frames)
-        assert self.time_encoding.shape == (2 * self.ext_frames, 3, self.H, self.W, 1), self.time_encoding.shape
-        self.dis_encoding = self._gen_dis_encoding(self.H, self.W, self.ext_frames)
-        assert self.dis_encoding.shape == (2 * self.ext_frames, self.H, self.W, 1), self.dis_encoding.shape
         self.normalize = normalize
         self.centralize = centralize
         self.num_ff = future_frames
@@ -54,19 +51,20 @@ class RSGOPRO:
         else:
             self.crop_h, self.crop_w = self.H, self.W
         self.inference = inference
+        self.crop_grid = max(crop_grid, 1)
 
     def _generate_samples(self, path):
         samples = []
         if self.is_test:
-            seqs = [seq for seq in sorted(os.listdir(path))[0:1] if not seq.endswith('avi')]
+            seqs = self._sequences(path)[0:1]
         else:
-            seqs = [seq for seq in sorted(os.listdir(path)) if not seq.endswith('avi')]
+            seqs = self._sequences(path)
         for seq in seqs[:10]:
             # if len(seq) == 3 and int(seq) > 39:
             #     print("Sequence {} is not used.".format(seq))
             #     continue
             seq_path = join(path, seq)
-            seq_num = len(os.listdir(join(seq_path, 'RS'))) // 2   #include t2b and b2t
+            seq_num = self._seq_len(seq_path)
             for i in range(self.num_pf, seq_num - self.num_ff):
                 sample = dict()
                 sample['RS'] = {}
@@ -98,123 +96,94 @@ class RSGOPRO:
                 samples.append(sample)
         return samples
 
-    def _gen_dis_encoding(self, h, w, ext_frames):
-        dis_encoding = []
-        if ext_frames == 1:
-            ref_rows = [(h - 1) / 2, ]
-        else:
-            ref_rows = np.linspace(0, h - 1, ext_frames)
-        for ref_row in ref_rows:
-            dis_encoding.append(distortion_map(h, w, ref_row)[..., np.newaxis])
-        for ref_row in ref_rows:
-            dis_encoding.append(distortion_map(h, w, ref_row, reverse=True)[..., np.newaxis])
-        dis_encoding = np.stack(dis_encoding, axis=0)  # (2*ext_frames, h, w, 1)
-        return dis_encoding
+    def _sequences(self, path):
+        return [seq for seq in sorted(os.listdir(path)) if not seq.endswith('avi')]
 
-    def _gen_time_coding(self, h, w, ext_frames):
-        time_coding = []
-        if ext_frames == 1:
-            ref_rows = [(h - 1) / 2, ]
-        else:
-            ref_rows = np.linspace(0, h - 1, ext_frames)
-        # print(ref_rows.shape)
-        for ref_row in ref_rows:
-            time_coding.append(time_map(h, w, ref_row))
-        for ref_row in ref_rows:
-            time_coding.append(time_map(h, w, ref_row, reverse=True))
-        # print(time_coding[0].shape)
-        time_coding = np.stack(time_coding, axis=0)  # (2*ext_frames, 3, h, w, 1)
-        # print(time_coding.shape)
-        return time_coding
+    def _seq_len(self, seq_path):
+        return len(os.listdir(join(seq_path, 'RS'))) // 2   #include t2b and b2t
+
+    def _read_img(self, img_path, top, left):
+        return self._data_augmentation(cv2.imread(img_path), top, left)
+
+    def _read_flow(self, fl_path, top, left):
+        return self._data_augmentation(np.load(fl_path), top, left)
 
     def __len__(self):
         # if self.inference:
         #     return len(self._samples) * 2
         return len(self._samples)
 
+    @property
+    def column_names(self):
+        """GeneratorDataset columns of a sample, fl_imgs is only shipped with flow supervision"""
+        flow = ['fl_imgs'] if self.flow else []
+        return ['rs_imgs', 'gs_imgs'] + flow + ['prior_imgs', 'time_rsc', 'all_time_rsc', 'crop_info', 'out_paths', 'input_path']
+
     def __getitem__(self, idx):
         index = random.choice(self.gs_indices[1:-1])
         index = 7
 
         # scane_line = np.linspace(0, self.H - 1, self.ext_frames)[index] / (self.H - 1)
-        rs_imgs, gs_imgs, fl_imgs, prior_imgs, time_rsc, all_time_rsc, out_paths, input_path = self._load_sample(self._samples[idx], index)
+        rs_imgs, gs_imgs, fl_imgs, prior_imgs, time_rsc, all_time_rsc, crop_info, out_paths, input_path = self._load_sample(self._samples[idx], index)
         assert rs_imgs.shape == (2*(self.num_ff + 1 + self.num_pf), 3, self.crop_h, self.crop_w), rs_imgs.shape  # t2b & b2t
         if self.inference:
             assert gs_imgs.shape == (self.ext_frames, 3, self.crop_h, self.crop_w), gs_imgs.shape   #0,index,8   *(self.num_ff + 1 + self.num_pf)
         else:
             assert gs_imgs.shape == (3, 3, self.crop_h, self.crop_w), gs_imgs.shape
-        assert fl_imgs.shape == (2 * self.ext_frames, 2, self.crop_h, self.crop_w), fl_imgs.shape    # * (self.num_ff + 1 + self.num_pf)
+        if self.flow:
+            assert fl_imgs.shape == (2 * self.ext_frames, 2, self.crop_h, self.crop_w), fl_imgs.shape    # * (self.num_ff + 1 + self.num_pf)
         assert prior_imgs.shape == (4, 3, 1, self.crop_h, self.crop_w), prior_imgs.shape   #(1/h)*index, 1, (timecode1,timecode2, warpmask)
         assert time_rsc.shape == (6, 1, self.crop_h, self.crop_w), time_rsc.shape
         assert all_time_rsc.shape == (2 * self.ext_frames, 1, self.crop_h, self.crop_w), all_time_rsc.shape
         rs_imgs = normalize(rs_imgs, normalize=self.normalize, centralize=self.centralize)
         gs_imgs = normalize(gs_imgs, normalize=self.normalize, centralize=self.centralize)
-        return rs_imgs, gs_imgs, fl_imgs, prior_imgs, time_rsc, all_time_rsc, out_paths, input_path
+        flow = (fl_imgs,) if self.flow else ()
+        return (rs_imgs, gs_imgs) + flow + (prior_imgs, time_rsc, all_time_rsc, crop_info, out_paths, input_path)
 
     def _load_sample(self, sample, index):
-        top = random.randint(0, self.H - self.crop_h)
-        left = random.randint(0, self.W - self.crop_w)
-        
-        rs_imgs, gs_imgs, fl_imgs, prior_imgs, time_rsc, all_time_rsc, out_paths, input_paths = [], [], [], [], [], [], [], []
+        top = random.randint(0, (self.H - self.crop_h) // self.crop_grid) * self.crop_grid
+        left = random.randint(0, (self.W - self.crop_w) // self.crop_grid) * self.crop_grid
+        crop_info = np.array([top, left, index], dtype=np.int32)  # crop window and time index of the sample
+
+        rs_imgs, gs_imgs, fl_imgs, out_paths, input_paths = [], [], [], [], []
         for rs_img_path in sample['RS']['t2b']:
-            img = self._data_augmentation(cv2.imread(rs_img_path), top, left)
+            img = self._read_img(rs_img_path, top, left)
             rs_imgs.append(img)
             out_paths.append(rs_img_path)
 
         for rs_img_path in sample['RS']['b2t']:
-            img = self._data_augmentation(cv2.imread(rs_img_path), top, left)  # , flip=True
+            img = self._read_img(rs_img_path, top, left)  # , flip=True
             rs_imgs.append(img)
             out_paths.append(rs_img_path)
 
-        for i in range(len(sample['GS'])):
-            if self.inference:
-                img = self._data_augmentation(cv2.imread(sample['GS'][i]), top, left)
-                gs_imgs.append(img)
-            else:
-                if i == 0 or i == index or i == len(sample['GS']) - 1:
-                    img = self._data_augmentation(cv2.imread(sample['GS'][i]), top, left)
-                    gs_imgs.append(img)
-        for i in range(len(sample['path'])):
-            if self.inference:
-                input_paths.append(sample['path'][i])
-            else:
-                if i == 0 or i == index or i == len(sample['path']) - 1:
-                    input_paths.append(sample['path'][i])
+        # only the GS frames used for supervision are read: 0, index, 8 in training, all in inference
+        if self.inference:
+            gs_ids = range(len(sample['GS']))
+        else:
+            gs_ids = [0, index, len(sample['GS']) - 1]
+        for i in gs_ids:
+            img = self._read_img(sample['GS'][i], top, left)
+            gs_imgs.append(img)
+            input_paths.append(sample['path'][i])
 
-        for fl_img_path in sample['FL']['t2b']:
-            if self.flow:
-                img = np.load(fl_img_path)
-            else:
-                img = np.zeros((self.H, self.W, 2), dtype='float32')
-            img = self._data_augmentation(img, top, left)
-            fl_imgs.append(img)
-        for fl_img_path in sample['FL']['b2t']:
-            if self.flow:
-                img = np.load(fl_img_path)
-            else:
-                img = np.zeros((self.H, self.W, 2), dtype='float32')
-            img = self._data_augmentation(img, top, left)
-            fl_imgs.append(img)
+        # flows are only read with flow supervision, otherwise fl_imgs is not part of the sample
+        if self.flow:
+            for fl_img_path in sample['FL']['t2b'] + sample['FL']['b2t']:
+                img = self._read_flow(fl_img_path, top, left)
+                fl_imgs.append(img)
 
-        for i in range(self.time_encoding.shape[0]):
-            if i % self.ext_frames == index or i % self.ext_frames == self.ext_frames-1:
-                # if is_b2t:
-                #     if i >= self.ext_frames:
-                img = self._data_augmentation(self.time_encoding[i].copy(), top, left)
-                prior_imgs.append(img)
-        for i in range(self.dis_encoding.shape[0]):
-            img = self._data_augmentation(self.dis_encoding[i].copy(), top, left)
-            all_time_rsc.append(img)
-            if i % self.ext_frames == 0 or i % self.ext_frames == index or i % self.ext_frames == self.ext_frames-1:
-                # img = self._data_augmentation(self.dis_encoding[i].copy(), top, left)
-                time_rsc.append(img)
+        rows = ref_rows(self.H, self.ext_frames)
+        prior_rows = rows[[index, self.ext_frames - 1]]
+        prior_imgs = np.concatenate((time_map_crop(self.H, prior_rows, top, self.crop_h, self.crop_w),
+                                     time_map_crop(self.H, prior_rows, top, self.crop_h, self.crop_w, reverse=True)), axis=0)  # t2b: index,8 ,  b2t: index, 8
+        all_time_rsc = np.concatenate((distortion_map_crop(self.H, rows, top, self.crop_h, self.crop_w),
+                                       distortion_map_crop(self.H, rows, top, self.crop_h, self.crop_w, reverse=True)), axis=0)
+        time_rsc = all_time_rsc[[i for i in range(2 * self.ext_frames)
+                                 if i % self.ext_frames in (0, index, self.ext_frames - 1)]]  # t2b: 0, index,8 ,  b2t: 0, index, 8
         rs_imgs = np.stack(rs_imgs, 0)
         gs_imgs = np.stack(gs_imgs, 0)
-        fl_imgs = np.stack(fl_imgs, 0)
-        prior_imgs = np.stack(prior_imgs, 0)  # t2b: index,8 ,  b2t: index, 8
-        time_rsc = np.stack(time_rsc, 0)  # t2b: 0, index,8 ,  b2t: 0, index, 8
-        all_time_rsc = np.stack(all_time_rsc, 0)
-        return rs_imgs, gs_imgs, fl_imgs, prior_imgs, time_rsc, all_time_rsc, out_paths, input_paths
+        fl_imgs = np.stack(fl_imgs, 0) if self.flow else None
+        return rs_imgs, gs_imgs, fl_imgs, prior_imgs, time_rsc, all_time_rsc, crop_info, out_paths, input_paths
 
     def _data_augmentation(self, img, top, left, flip=False):
         if img.ndim == 3:
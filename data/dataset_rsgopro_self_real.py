@@ -10,7 +10,7 @@ import cv2
 import numpy as np
 import mindspore as ms
 import mindspore.ops as O
-from data.distortion_prior import distortion_map, time_map
+from data.distortion_prior import ref_rows, distortion_map_crop, time_map_crop
 from data.utils import normalize, flow_to_image
 from models.warplayer import warp
 
@@ -40,10 +40,6 @@ class RSGOPRO:
         self.flow = flow
         # assert ext_frames in [1, 3, 5, 9], "ext_frames should be [1 | 3 | 5 | 9]"
         self.ext_frames = ext_frames
-        self.time_encoding = self._gen_time_coding(self.H, self.W, self.ext_frames)
-        assert self.time_encoding.shape == (2 * self.ext_frames, 3, self.H, self.W, 1), self.time_encoding.shape
-        self.dis_encoding = self._gen_dis_encoding(self.H, self.W, self.ext_frames)
-        assert self.dis_encoding.shape == (2 * self.ext_frames, self.H, self.W, 1), self.dis_encoding.shape
         self.normalize = normalize
         self.centralize = centralize
         self.num_ff = future_frames
@@ -89,55 +85,35 @@ class RSGOPRO:
                 samples.append(sample)
         return samples
 
-    def _gen_dis_encoding(self, h, w, ext_frames):
-        dis_encoding = []
-        if ext_frames == 1:
-            ref_rows = [(h - 1) / 2, ]
-        else:
-            ref_rows = np.linspace(0, h - 1, ext_frames)
-        for ref_row in ref_rows:
-            dis_encoding.append(distortion_map(h, w, ref_row)[..., np.newaxis])
-        for ref_row in ref_rows:
-            dis_encoding.append(distortion_map(h, w, ref_row, reverse=True)[..., np.newaxis])
-        dis_encoding = np.stack(dis_encoding, axis=0)  # (2*ext_frames, h, w, 1)
-        return dis_encoding
-
-    def _gen_time_coding(self, h, w, ext_frames):
-        time_coding = []
-        if ext_frames == 1:
-            ref_rows = [(h - 1) / 2, ]
-        else:
-            ref_rows = np.linspace(0, h - 1, ext_frames)
-        # print(ref_rows.shape)
-        for ref_row in ref_rows:
-            time_coding.append(time_map(h, w, ref_row))
-        for ref_row in ref_rows:
-            time_coding.append(time_map(h, w, ref_row, reverse=True))
-        # print(time_coding[0].shape)
-        time_coding = np.stack(time_coding, axis=0)  # (2*ext_frames, 3, h, w, 1)
-        # print(time_coding.shape)
-        return time_coding
-
     def __len__(self):
         return len(self._samples)
 
+    @property
+    def column_names(self):
+        """GeneratorDataset columns of a sample, fl_imgs is only shipped with flow supervision"""
+        flow = ['fl_imgs'] if self.flow else []
+        return ['rs_imgs', 'gs_imgs'] + flow + ['prior_imgs', 'time_rsc', 'all_time_rsc', 'crop_info', 'out_paths', 'input_path']
+
     def __getitem__(self, idx):
         index = random.choice(self.gs_indices[1:-1])
 
         # scane_line = np.linspace(0, self.H - 1, self.ext_frames)[index] / (self.H - 1)
-        rs_imgs, prior_imgs, time_rsc, all_time_rsc, out_paths = self._load_sample(self._samples[idx], index)
+        rs_imgs, prior_imgs, time_rsc, all_time_rsc, crop_info, out_paths = self._load_sample(self._samples[idx], index)
         assert rs_imgs.shape == (2*(self.num_ff + 1 + self.num_pf), 3, self.crop_h, self.crop_w), rs_imgs.shape  # t2b & b2t
         assert prior_imgs.shape == (4, 3, 1, self.crop_h, self.crop_w), prior_imgs.shape   #(1/h)*index, 1, (timecode1,timecode2, warpmask)
         assert time_rsc.shape == (6, 1, self.crop_h, self.crop_w), time_rsc.shape
         assert all_time_rsc.shape == (2 * self.ext_frames, 1, self.crop_h, self.crop_w), all_time_rsc.shape
         rs_imgs = normalize(rs_imgs, normalize=self.normalize, centralize=self.centralize)
         # gs_imgs = normalize(gs_imgs, normalize=self.normalize, centralize=self.centralize)
-        return rs_imgs, rs_imgs, rs_imgs, prior_imgs, time_rsc, all_time_rsc, out_paths, out_paths
+        # no GS frames or flows for real data, rs_imgs stand in for them
+        flow = (rs_imgs,) if self.flow else ()
+        return (rs_imgs, rs_imgs) + flow + (prior_imgs, time_rsc, all_time_rsc, crop_info, out_paths, out_paths)
 
     def _load_sample(self, sample, index):
         top = random.randint(0, self.H - self.crop_h)
         left = random.randint(0, self.W - self.crop_w)
-        rs_imgs, gs_imgs, fl_imgs, prior_imgs, time_rsc, all_time_rsc, out_paths, input_paths = [], [], [], [], [], [], [], []
+        crop_info = np.array([top, left, index], dtype=np.int32)  # crop window and time index of the sample
+        rs_imgs, gs_imgs, fl_imgs, out_paths, input_paths = [], [], [], [], []
         for rs_img_path in sample['RS']['t2b']:
             img = self._data_augmentation(cv2.imread(rs_img_path), top, left)
             rs_imgs.append(img)
@@ -148,29 +124,18 @@ class RSGOPRO:
             rs_imgs.append(img)
             out_paths.append(rs_img_path)
 
-        for i in range(self.time_encoding.shape[0]):
-            if i % self.ext_frames == index or i % self.ext_frames == self.ext_frames-1:
-                # if is_b2t:
-                #     if i >= self.ext_frames:
-                img = self._data_augmentation(self.time_encoding[i].copy(), top, left)
-                prior_imgs.append(img)
-                # else:
-                #     if i < self.ext_frames:
-                #         img = self._data_augmentation(self.time_encoding[i].copy(), top, left)
-                #         prior_imgs.append(img)
-        for i in range(self.dis_encoding.shape[0]):
-            img = self._data_augmentation(self.dis_encoding[i].copy(), top, left)
-            all_time_rsc.append(img)
-            if i % self.ext_frames == 0 or i % self.ext_frames == index or i % self.ext_frames == self.ext_frames-1:
-                # img = self._data_augmentation(self.dis_encoding[i].copy(), top, left)
-                time_rsc.append(img)
+        rows = ref_rows(self.H, self.ext_frames)
+        prior_rows = rows[[index, self.ext_frames - 1]]
+        prior_imgs = np.concatenate((time_map_crop(self.H, prior_rows, top, self.crop_h, self.crop_w),
+                                     time_map_crop(self.H, prior_rows, top, self.crop_h, self.crop_w, reverse=True)), axis=0)  # t2b: index,8 ,  b2t: index, 8
+        all_time_rsc = np.concatenate((distortion_map_crop(self.H, rows, top, self.crop_h, self.crop_w),
+                                       distortion_map_crop(self.H, rows, top, self.crop_h, self.crop_w, reverse=True)), axis=0)
+        time_rsc = all_time_rsc[[i for i in range(2 * self.ext_frames)
+                                 if i % self.ext_frames in (0, index, self.ext_frames - 1)]]  # t2b: 0, index,8 ,  b2t: 0, index, 8
         rs_imgs = O.stack(rs_imgs, dim=0)
         # gs_imgs = O.stack(gs_imgs, dim=0)
         # fl_imgs = O.stack(fl_imgs, dim=0)
-        prior_imgs = O.stack(prior_imgs, dim=0)  # t2b: index,8 ,  b2t: index, 8
-        time_rsc = O.stack(time_rsc, dim=0)  # t2b: 0, index,8 ,  b2t: 0, index, 8
-        all_time_rsc = O.stack(all_time_rsc, dim=0)
-        return rs_imgs, prior_imgs, time_rsc, all_time_rsc, out_paths
+        return rs_imgs, prior_imgs, time_rsc, all_time_rsc, crop_info, out_paths
 
     def _data_augmentation(self, img, top, left, flip=False):
         if img.ndim == 3:
@@ -0,0 +1,42 @@
+"""
+RS-GOPRO dataset read from binary shards (see data/create_rs_shards.py)
+Same samples as data.dataset_rsgopro_self.RSGOPRO, crops are read from memory mapped shards
+instead of decoding whole PNG frames
+"""
+
+import os
+from os.path import join
+
+from data.dataset_rsgopro_self import RSGOPRO
+from data.rs_shard import ShardReader
+
+
+class RSGOPROShard(RSGOPRO):
+    """ Dataset class for RS-GOPRO shards, path is the shard directory of a split"""
+
+    def __init__(self, path, *args, **kwargs):
+        self.root = path
+        self._readers = {}
+        super(RSGOPROShard, self).__init__(path, *args, **kwargs)
+
+    def _reader(self, seq):
+        if seq not in self._readers:
+            self._readers[seq] = ShardReader(join(self.root, seq))
+        return self._readers[seq]
+
+    def _sequences(self, path):
+        return [name[:-len('.json')] for name in sorted(os.listdir(path)) if name.endswith('.json')]
+
+    def _seq_len(self, seq_path):
+        return self._reader(os.path.basename(seq_path)).meta['seq_num']
+
+    def _read_window(self, file_path, top, left):
+        # sample paths keep the original layout, root/seq/sub/name -> shard seq, key sub/name
+        seq, sub, name = os.path.relpath(file_path, self.root).split(os.sep)[-3:]
+        return self._reader(seq).read_window('{}/{}'.format(sub, name), top, left, self.crop_h, self.crop_w)
+
+    def _read_img(self, img_path, top, left):
+        return self._data_augmentation(self._read_window(img_path, top, left), 0, 0)
+
+    def _read_flow(self, fl_path, top, left):
+        return self._data_augmentation(self._read_window(fl_path, top, left), 0, 0)  # float16 -> float32
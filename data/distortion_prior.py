@@ -71,7 +71,71 @@ def time_map(h, w, ref_row, reverse=False):
 
     return np.stack([formask[..., np.newaxis], backmask[..., np.newaxis], warpmask[..., np.newaxis]], axis=0)
 
+
+'''
+# --------------------------------------------
+# analytic crops of distortion_map / time_map
+# both maps only depend on the row, so a crop is one broadcast over (ref_rows, rows)
+# --------------------------------------------
+'''
+
+
+def _crop_rows(h, ref_rows, top, crop_h, reverse):
+    ref_rows = np.asarray(ref_rows, dtype=np.float64).reshape(-1, 1)
+    rows = np.arange(top, top + crop_h, dtype=np.float64).reshape(1, -1)
+    if reverse:
+        rows = h - 1 - rows
+    return ref_rows, rows
+
+
+def distortion_map_crop(h, ref_rows, top, crop_h, crop_w, reverse=False):
+    """
+    rows [top, top+crop_h) of distortion_map for several reference rows
+    returns: (len(ref_rows), 1, crop_h, crop_w) float32
+    """
+    ref_rows, rows = _crop_rows(h, ref_rows, top, crop_h, reverse)
+    mask = (rows - ref_rows) / (h - 1)
+    return np.repeat(mask.astype(np.float32)[:, np.newaxis, :, np.newaxis], crop_w, axis=-1)
+
+
+def time_map_crop(h, ref_rows, top, crop_h, crop_w, reverse=False):
+    """
+    rows [top, top+crop_h) of time_map for several reference rows, nan/inf where time_map has them
+    returns: (len(ref_rows), 3, 1, crop_h, crop_w) float32
+    """
+    ref_rows, rows = _crop_rows(h, ref_rows, top, crop_h, reverse)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        mask = rows / ref_rows
+        # full-frame max of the back mask before normalization, nan propagates from row 0 when ref_row is 0
+        back_max = np.where(ref_rows == 0, np.nan, (h - 1) / ref_rows - 1)
+        formask = np.where(mask > 1, 1., mask)
+        warpmask = np.where(mask <= 1, 1., np.where(mask > 1, 0., mask))
+        if reverse:
+            backmask = np.where(mask < 1, -1., np.where(mask >= 1, mask - 1, mask)) / back_max
+            backmask = np.where(backmask < 0, 0., backmask)
+        else:
+            backmask = np.where(mask < 1, 0., np.where(mask >= 1, mask - 1, mask)) / back_max
+    masks = np.stack([formask, backmask, warpmask], axis=1).astype(np.float32)  # n, 3, crop_h
+    return np.repeat(masks[:, :, np.newaxis, :, np.newaxis], crop_w, axis=-1)
+
+
+def ref_rows(h, ext_frames):
+    if ext_frames == 1:
+        return np.array([(h - 1) / 2, ])
+    return np.linspace(0, h - 1, ext_frames)
+
+
 if __name__ == '__main__':
+    # analytic crops against the full-frame maps
+    h, w, top, crop_h, crop_w = 540, 960, 100, 256, 256
+    rows = ref_rows(h, 9)
+    for reverse in [False, True]:
+        full = np.stack([distortion_map(h, w, r, reverse) for r in rows])[:, np.newaxis, top:top + crop_h, :crop_w]
+        print('distortion_map_crop', reverse, np.abs(distortion_map_crop(h, rows, top, crop_h, crop_w, reverse) - full).max())
+        with np.errstate(divide='ignore', invalid='ignore'):
+            full = np.stack([time_map(h, w, r, reverse) for r in rows])[..., top:top + crop_h, :crop_w, 0][:, :, np.newaxis]
+        print('time_map_crop', reverse, np.allclose(time_map_crop(h, rows, top, crop_h, crop_w, reverse), full, atol=1e-6, equal_nan=True))
+
     mask = distortion_map(h=256, w=256, ref_row=0)
     print('mask', mask)
     mask = distortion_map(h=256, w=256, ref_row=255 / 2)
@@ -0,0 +1,187 @@
+"""
+Prefetching loader for RSGOPRO-like datasets
+
+Worker processes fill preallocated shared-memory batch slots (a ring of prefetch * num_workers slots),
+so numeric columns never go through pickling, only slot ids and the path strings do.
+Each batch is seeded from (seed, epoch, batch index), samples do not depend on which worker loads them.
+"""
+
+import time
+import random
+import traceback
+import multiprocessing as mp
+from multiprocessing import shared_memory
+
+import numpy as np
+import mindspore as ms
+
+
+def _as_numpy(col):
+    return col.asnumpy() if hasattr(col, 'asnumpy') else col
+
+
+def _is_array(col):
+    return isinstance(col, np.ndarray) and col.dtype.kind in 'biuf'
+
+
+def _batch_seed(seed, epoch, batch_idx):
+    return (seed * 1000003 + epoch * 10007 + batch_idx) % (2 ** 32)
+
+
+def _worker_loop(dataset, slot_names, specs, task_q, done_q):
+    shms = [[shared_memory.SharedMemory(name=name) for name in names] for names in slot_names]
+    slots = [[np.ndarray(shape, dtype=dtype, buffer=shm.buf) for shm, (shape, dtype) in zip(slot, specs)]
+             for slot in shms]
+    while True:
+        task = task_q.get()
+        if task is None:
+            break
+        slot, batch_idx, epoch, seed, indices = task
+        try:
+            random.seed(_batch_seed(seed, epoch, batch_idx))
+            np.random.seed(_batch_seed(seed, epoch, batch_idx))
+            strings = []
+            for k, idx in enumerate(indices):
+                sample = [_as_numpy(col) for col in dataset[idx]]
+                strings.append([col for col in sample if not _is_array(col)])
+                for buf, col in zip(slots[slot], [col for col in sample if _is_array(col)]):
+                    buf[k] = col
+            done_q.put((slot, batch_idx, strings, None))
+        except Exception:
+            done_q.put((slot, batch_idx, None, traceback.format_exc()))
+    del slots
+    for slot in shms:
+        for shm in slot:
+            shm.close()
+
+
+class PrefetchLoader:
+    """
+    Parameters:
+        dataset: RSGOPRO-like dataset, samples are tuples of fixed-shape arrays and path lists
+        batch_size: samples per batch
+        shuffle: reshuffle the samples every epoch
+        num_workers: number of loader processes
+        prefetch: batch slots per worker, i.e. how many batches are loaded ahead
+        drop_last: drop the last incomplete batch
+        seed: base seed of shuffling and of the per-batch sample seeds
+
+    Iterating yields lists of columns like GeneratorDataset: arrays as ms.Tensor, paths as numpy string arrays.
+    stall_time / num_batches report how long the consumer waited for input in the current (or last) epoch.
+    """
+
+    def __init__(self, dataset, batch_size, shuffle=True, num_workers=4, prefetch=2, drop_last=True, seed=0):
+        self.dataset = dataset
+        self.batch_size = batch_size
+        self.shuffle = shuffle
+        self.num_workers = max(num_workers, 1)
+        self.num_slots = max(prefetch, 1) * self.num_workers
+        self.drop_last = drop_last
+        self.seed = seed
+        self.closed = True
+        self.epoch = 0
+        self.stall_time = 0.
+        self.num_batches = 0
+
+        # column layout from a probe sample
+        probe = [_as_numpy(col) for col in dataset[0]]
+        self.is_array = [_is_array(col) for col in probe]
+        self.specs = [((batch_size,) + col.shape, col.dtype.str) for col in probe if _is_array(col)]
+        self.shms = [[shared_memory.SharedMemory(create=True, size=max(int(np.prod(shape)) * np.dtype(dtype).itemsize, 1))
+                      for shape, dtype in self.specs] for _ in range(self.num_slots)]
+        self.slots = [[np.ndarray(shape, dtype=dtype, buffer=shm.buf) for shm, (shape, dtype) in zip(slot, self.specs)]
+                      for slot in self.shms]
+
+        ctx = mp.get_context('fork') if 'fork' in mp.get_all_start_methods() else mp.get_context()
+        self.task_q = ctx.Queue()
+        self.done_q = ctx.Queue()
+        slot_names = [[shm.name for shm in slot] for slot in self.shms]
+        self.workers = [ctx.Process(target=_worker_loop, args=(dataset, slot_names, self.specs, self.task_q, self.done_q),
+                                    daemon=True) for _ in range(self.num_workers)]
+        for w in self.workers:
+            w.start()
+        self.closed = False
+        self.inflight = 0
+
+    def __len__(self):
+        if self.drop_last:
+            return len(self.dataset) // self.batch_size
+        return int(np.ceil(len(self.dataset) / self.batch_size))
+
+    def _batches(self):
+        if self.shuffle:
+            order = np.random.RandomState(_batch_seed(self.seed, self.epoch, 0)).permutation(len(self.dataset))
+        else:
+            order = np.arange(len(self.dataset))
+        return [order[i:i + self.batch_size].tolist() for i in range(0, len(self) * self.batch_size, self.batch_size)]
+
+    def _collate(self, slot, size, strings):
+        arrays = iter(self.slots[slot])
+        texts = iter(zip(*strings))
+        batch = []
+        for is_array in self.is_array:
+            if is_array:
+                batch.append(ms.Tensor(next(arrays)[:size]))  # copies, the slot is reused afterwards
+            else:
+                batch.append(np.array(next(texts)))
+        return batch
+
+    def __iter__(self):
+        # results of an abandoned epoch
+        while self.inflight:
+            self.done_q.get()
+            self.inflight -= 1
+        self.stall_time, self.num_batches = 0., 0  # stats of this epoch
+        batches = self._batches()
+        free = list(range(self.num_slots))
+        submitted, ready = 0, {}
+
+        def _submit():
+            nonlocal submitted
+            while free and submitted < len(batches):
+                self.task_q.put((free.pop(), submitted, self.epoch, self.seed, batches[submitted]))
+                submitted += 1
+                self.inflight += 1
+
+        _submit()
+        for batch_idx in range(len(batches)):
+            t = time.time()
+            while batch_idx not in ready:
+                slot, done_idx, strings, error = self.done_q.get()
+                self.inflight -= 1
+                if error is not None:
+                    self.close()
+                    raise RuntimeError('PrefetchLoader worker failed on batch {}:\n{}'.format(done_idx, error))
+                ready[done_idx] = (slot, strings)
+            self.stall_time += time.time() - t
+            self.num_batches += 1
+            slot, strings = ready.pop(batch_idx)
+            batch = self._collate(slot, len(batches[batch_idx]), strings)
+            free.append(slot)
+            _submit()
+            yield batch
+        self.epoch += 1
+
+    def stats(self):
+        """average and total time the consumer waited for a batch in the current (or last) epoch"""
+        return {'stall_time': self.stall_time, 'stall_per_batch': self.stall_time / max(self.num_batches, 1),
+                'num_batches': self.num_batches}
+
+    def close(self):
+        if self.closed:
+            return
+        self.closed = True
+        for _ in self.workers:
+            self.task_q.put(None)
+        for w in self.workers:
+            w.join(timeout=5)
+            if w.is_alive():
+                w.terminate()
+        self.slots = None
+        for slot in self.shms:
+            for shm in slot:
+                shm.close()
+                shm.unlink()
+
+    def __del__(self):
+        self.close()
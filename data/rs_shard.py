@@ -0,0 +1,123 @@
+"""
+Packed binary shards of RS-GOPRO sequences
+
+One shard per sequence: <seq>.bin holds the arrays back to back, <seq>.json indexes them by their
+path relative to the sequence directory (e.g. 'RS/00000010_rs_t2b.png', 'FL/00000010_fl_t2b_004.npy').
+Arrays are HxWxC, stored raw (memory mapped, a crop only touches its own pages) or as zlib compressed
+2D tiles (a crop only decodes the tiles covering its window).
+"""
+
+import json
+import mmap
+import zlib
+import numpy as np
+
+ALIGN = 64
+
+
+class ShardWriter:
+    """
+    Parameters:
+        shard_path: shard path without extension
+        codec: 'raw' | 'zlib'
+        chunk_rows: rows per compressed tile
+        chunk_cols: columns per compressed tile, None for whole rows
+        level: zlib compression level, 1 is the fastest
+    """
+
+    def __init__(self, shard_path, codec='raw', chunk_rows=64, chunk_cols=64, level=1, meta=None):
+        assert codec in ['raw', 'zlib'], codec
+        self.shard_path = shard_path
+        self.codec = codec
+        self.chunk_rows = chunk_rows
+        self.chunk_cols = chunk_cols
+        self.level = level
+        self.meta = meta or {}
+        self.entries = {}
+        self.f = open(shard_path + '.bin', 'wb')
+
+    def add(self, key, img):
+        img = np.ascontiguousarray(img)
+        if img.ndim == 2:
+            img = img[..., np.newaxis]
+        assert img.ndim == 3, img.shape
+        self.f.write(b'\0' * (-self.f.tell() % ALIGN))
+        entry = {'offset': self.f.tell(), 'shape': list(img.shape), 'dtype': img.dtype.str, 'codec': self.codec}
+        if self.codec == 'raw':
+            self.f.write(img.tobytes())
+        else:
+            rows, cols = self.chunk_rows, self.chunk_cols or img.shape[1]
+            chunks = []  # row-major tile grid
+            for top in range(0, img.shape[0], rows):
+                for left in range(0, img.shape[1], cols):
+                    data = zlib.compress(np.ascontiguousarray(img[top:top + rows, left:left + cols]).tobytes(), self.level)
+                    chunks.append([self.f.tell(), len(data)])
+                    self.f.write(data)
+            entry['chunk_rows'] = rows
+            entry['chunk_cols'] = cols
+            entry['chunks'] = chunks
+        self.entries[key] = entry
+
+    def close(self):
+        self.f.close()
+        with open(self.shard_path + '.json', 'w') as f:
+            json.dump({'meta': self.meta, 'entries': self.entries}, f)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+
+class ShardReader:
+    """read-only access to a shard, the mmap is opened lazily so readers can be pickled into workers"""
+
+    def __init__(self, shard_path):
+        self.shard_path = shard_path
+        with open(shard_path + '.json', 'r') as f:
+            index = json.load(f)
+        self.meta = index['meta']
+        self.entries = index['entries']
+        self._buf = None
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        state['_buf'] = None
+        return state
+
+    def __contains__(self, key):
+        return key in self.entries
+
+    def _buffer(self):
+        if self._buf is None:
+            with open(self.shard_path + '.bin', 'rb') as f:
+                self._buf = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        return self._buf
+
+    def read_window(self, key, top, left, height, width):
+        """window [top, top+height) x [left, left+width) of an array, HxWxC"""
+        entry = self.entries[key]
+        h, w, ch = entry['shape']
+        dtype = np.dtype(entry['dtype'])
+        buf = self._buffer()
+        if entry['codec'] == 'raw':
+            img = np.frombuffer(buf, dtype=dtype, count=h * w * ch, offset=entry['offset']).reshape(h, w, ch)
+            return img[top:top + height, left:left + width]
+        rows, cols = entry['chunk_rows'], entry.get('chunk_cols', w)
+        grid_w = -(-w // cols)
+        r0, r1 = top // rows, (top + height - 1) // rows
+        c0, c1 = left // cols, (left + width - 1) // cols
+
+        def _tile(r, c):
+            offset, size = entry['chunks'][r * grid_w + c]
+            return np.frombuffer(zlib.decompress(buf[offset:offset + size]), dtype=dtype).reshape(-1, min(cols, w - c * cols), ch)
+
+        img = np.concatenate([np.concatenate([_tile(r, c) for c in range(c0, c1 + 1)], axis=1)
+                              for r in range(r0, r1 + 1)], axis=0)
+        top, left = top - r0 * rows, left - c0 * cols
+        return img[top:top + height, left:left + width]
+
+    def read(self, key):
+        h, w = self.entries[key]['shape'][:2]
+        return self.read_window(key, 0, 0, h, w)
@@ -0,0 +1,177 @@
+import os.path
+import time
+import argparse
+import random
+import logging
+import numpy as np
+from mindspore.dataset import GeneratorDataset as DataLoader
+
+from utils import utils_logger
+from utils import utils_image as util
+from utils import utils_option as option
+
+from models.select_model import define_Model
+from models.flow_pwc import Flow_PWC
+
+from data.dataset_rsgopro_self import RSGOPRO as D
+from data.dataset_rsgopro_shard import RSGOPROShard
+
+import mindspore as ms
+
+
+'''
+# --------------------------------------------
+# teacher-speed benchmark
+# step time vs self-supervised reconstruction PSNR for several
+# (teacher_scale, teacher_output_level, teacher_precision) settings of the PWC teacher,
+# the flow drift is the EPE against the teacher of the first setting on the same frames
+# --------------------------------------------
+'''
+
+
+PAIRS = [(0, 2), (2, 0), (0, 1), (1, 0), (1, 2), (2, 1)]
+
+
+def parse_setting(text):
+    """'0.5:3:fp16' -> (0.5, 3, 'fp16'), '1.0' or '1.0:none' -> (1.0, None, 'fp32')"""
+    fields = text.split(':') + ['', '']
+    level = None if fields[1].lower() in ('', 'none', 'null') else int(fields[1])
+    return float(fields[0]), level, fields[2] or 'fp32'
+
+
+def setting_name(setting):
+    scale, level, precision = setting
+    return '{:.2f}/{}/{}'.format(scale, 'full' if level is None else level, precision)
+
+
+def epe(flows, ref_flows):
+    """mean end-point error between two lists of [B, 2, H, W] flows"""
+    return float(np.mean([((f - r) ** 2).sum(axis=1).sqrt().mean().asnumpy() for f, r in zip(flows, ref_flows)]))
+
+
+def recon_psnr(model, border=0):
+    """PSNR of the reconstructed RS pair (L_t2b, L_b2t) against the cropped input RS pair"""
+    d = model.diff_patch // 2
+    psnr = []
+    for k, rec in enumerate([model.L_t2b, model.L_b2t]):
+        rec_img = util.tensor2uint_list(rec)
+        ref_img = util.tensor2uint_list(model.L[:, k, :, d:-d, d:-d])
+        psnr += [util.calculate_psnr(e, h, border=border) for e, h in zip(rec_img, ref_img)]
+    return float(np.mean(psnr))
+
+
+def main(json_path='options/train_srsc_rsflow_multi_distillv2_psnr.json'):
+
+    '''
+    # ----------------------------------------
+    # Step--1 (prepare opt)
+    # ----------------------------------------
+    '''
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--opt', type=str, default=json_path, help='Path to option JSON file.')
+    parser.add_argument('--settings', type=str, nargs='+',
+                        default=['1.0:none:fp32', '1.0:none:fp16', '1.0:none:int8', '1.0:3', '0.5:none', '0.5:3', '0.5:2'],
+                        help='teacher_scale:teacher_output_level[:teacher_precision], none for the full level, '
+                             'the first one is the reference of the flow drift.')
+    parser.add_argument('--batches', type=int, default=8, help='Training batches per setting.')
+    parser.add_argument('--warmup', type=int, default=2, help='Untimed batches per setting.')
+    args = parser.parse_args()
+
+    opt = option.parse(args.opt, is_train=True)
+    opt['dist'] = False
+    opt['rank'], opt['world_size'] = 0, 1
+    opt = option.dict_to_nonedict(opt)
+
+    logger_name = 'benchmark_teacher'
+    utils_logger.logger_info(logger_name, os.path.join(opt['path']['log'], logger_name+'.log'))
+    logger = logging.getLogger(logger_name)
+
+    seed = opt['train']['manual_seed'] or 0
+    random.seed(seed)
+    np.random.seed(seed)
+    ms.set_seed(seed)
+
+    '''
+    # ----------------------------------------
+    # Step--2 (fixed training batches)
+    # ----------------------------------------
+    '''
+
+    dataset_opt = opt['datasets']['train']
+    if dataset_opt['shard_root']:
+        D_train, path = RSGOPROShard, os.path.join(dataset_opt['shard_root'], 'train')
+    else:
+        D_train, path = D, os.path.join(dataset_opt['data_root'], 'train')
+    train_set = D_train(path, dataset_opt['future_frames'], dataset_opt['past_frames'], dataset_opt['frames'], dataset_opt['patch_size'], dataset_opt['centralize'],
+                        dataset_opt['normalize'], False, False)
+    train_loader = DataLoader(train_set, shuffle=False, num_parallel_workers=dataset_opt['dataloader_num_workers'],
+                              column_names=train_set.column_names).batch(dataset_opt['dataloader_batch_size'], drop_remainder=True)
+    batches = []
+    for train_data in train_loader:
+        batches.append(train_data)
+        if len(batches) == args.warmup + args.batches:
+            break
+
+    '''
+    # ----------------------------------------
+    # Step--3 (initialize model)
+    # ----------------------------------------
+    '''
+
+    model = define_Model(opt)
+    model.init_train()
+    settings = [parse_setting(s) for s in args.settings]
+    teachers = {setting: Flow_PWC(load_pretrain=True, pretrain_fn=opt['path']['pretrained_rsg'], scale=setting[0],
+                                  output_level=setting[1], precision=setting[2]) for setting in settings}
+    reference = teachers[settings[0]]
+
+    '''
+    # ----------------------------------------
+    # Step--4 (benchmark)
+    # ----------------------------------------
+    '''
+
+    # reconstruction PSNR first, every setting sees the same initial weights
+    results = {}
+    for setting in settings:
+        model.net_rsg = teachers[setting]
+        model.define_train_step()  # the training forward holds on to the teacher it was built with
+        psnr, drift, teacher_time = [], [], 0.
+        for train_data in batches[args.warmup:]:
+            model.feed_data(train_data)
+            model.netG_forward()
+            frames = [model.E[:, 0], model.E[:, 1], model.E[:, 2]]
+            t = time.time()
+            flows = model.net_rsg.estimate_flows(frames, PAIRS)
+            flows[-1].asnumpy()
+            teacher_time += time.time() - t
+            drift.append(epe(flows, reference.estimate_flows(frames, PAIRS)))
+            psnr.append(recon_psnr(model))
+        results[setting] = {'psnr': float(np.mean(psnr)), 'epe': float(np.mean(drift)), 'teacher': teacher_time / len(psnr)}
+
+    # step time, the weights drift between settings but the cost does not depend on them
+    for setting in settings:
+        model.net_rsg = teachers[setting]
+        model.define_train_step()
+        step_time = 0.
+        for i, train_data in enumerate(batches):
+            model.feed_data(train_data)
+            t = time.time()
+            model.optimize_parameters(i + 1)
+            if i >= args.warmup:
+                step_time += time.time() - t
+        results[setting]['step'] = step_time / max(len(batches) - args.warmup, 1)
+
+    base = results[settings[0]]
+    logger.info('{:>18s} | {:>10s} {:>10s} {:>8s} | {:>8s} {:>8s} {:>8s}'.format(
+        'scale/level/prec', 'step(ms)', 'flow(ms)', 'speedup', 'PSNR', 'dPSNR', 'EPE'))
+    for setting in settings:
+        r = results[setting]
+        logger.info('{:>18s} | {:>10.1f} {:>10.1f} {:>7.2f}x | {:>8.2f} {:>+8.2f} {:>8.4f}'.format(
+            setting_name(setting), r['step'] * 1000, r['teacher'] * 1000,
+            base['step'] / r['step'], r['psnr'], r['psnr'] - base['psnr'], r['epe']))
+
+
+if __name__ == '__main__':
+    main()
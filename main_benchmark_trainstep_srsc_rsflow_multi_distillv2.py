@@ -0,0 +1,163 @@
+import os.path
+import time
+import argparse
+import random
+import logging
+import numpy as np
+from mindspore.dataset import GeneratorDataset as DataLoader
+
+from utils import utils_logger
+from utils import utils_option as option
+
+from models.select_model import define_Model
+from models.train_step import TrainStep
+from models.ema import FusedEMA, ema_reference
+
+from data.dataset_rsgopro_self import RSGOPRO as D
+from data.dataset_rsgopro_shard import RSGOPROShard
+
+import mindspore as ms
+
+
+'''
+# --------------------------------------------
+# training-step benchmark
+# step time of the PyNative step vs the ms.jit compiled step on the same batches,
+# and the per-step overhead of the netE EMA update, fused vs parameter by parameter
+# --------------------------------------------
+'''
+
+
+def run_steps(model, train_step, batches, warmup):
+    """average time of the steps after warmup, first step time and the last loss"""
+    step_time, first_time = 0., 0.
+    for i, train_data in enumerate(batches):
+        model.feed_data(train_data)
+        inputs = model.train_inputs()
+        t = time.time()
+        G_loss, _ = train_step(*inputs)
+        G_loss = G_loss.item()  # waits for the step
+        if i == 0:
+            first_time = time.time() - t
+        if i >= warmup:
+            step_time += time.time() - t
+    return step_time / max(len(batches) - warmup, 1), first_time, G_loss
+
+
+def time_updates(update, net, iters):
+    """average time of an in-place parameter update, synchronized on the last parameter"""
+    update()
+    last = list(net.get_parameters())[-1]
+    last.asnumpy()
+    t = time.time()
+    for _ in range(iters):
+        update()
+    last.asnumpy()
+    return (time.time() - t) / iters
+
+
+def snapshot(net):
+    return {name: param.asnumpy().copy() for name, param in net.parameters_and_names()}
+
+
+def restore(net, state):
+    for name, param in net.parameters_and_names():
+        param.set_data(ms.Tensor(state[name]))
+
+
+def main(json_path='options/train_srsc_rsflow_multi_distillv2_psnr.json'):
+
+    '''
+    # ----------------------------------------
+    # Step--1 (prepare opt)
+    # ----------------------------------------
+    '''
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--opt', type=str, default=json_path, help='Path to option JSON file.')
+    parser.add_argument('--batches', type=int, default=20, help='Training batches per mode.')
+    parser.add_argument('--warmup', type=int, default=3, help='Untimed batches per mode, incl. compilation.')
+    parser.add_argument('--ema_iters', type=int, default=20, help='Timed EMA updates per variant.')
+    parser.add_argument('--ema_every', type=int, nargs='+', default=[1, 4, 16], help='EMA update intervals to report.')
+    args = parser.parse_args()
+
+    opt = option.parse(args.opt, is_train=True)
+    opt['dist'] = False
+    opt['rank'], opt['world_size'] = 0, 1
+    opt = option.dict_to_nonedict(opt)
+
+    logger_name = 'benchmark_trainstep'
+    utils_logger.logger_info(logger_name, os.path.join(opt['path']['log'], logger_name+'.log'))
+    logger = logging.getLogger(logger_name)
+
+    seed = opt['train']['manual_seed'] or 0
+    random.seed(seed)
+    np.random.seed(seed)
+    ms.set_seed(seed)
+
+    '''
+    # ----------------------------------------
+    # Step--2 (fixed training batches)
+    # ----------------------------------------
+    '''
+
+    dataset_opt = opt['datasets']['train']
+    if dataset_opt['shard_root']:
+        D_train, path = RSGOPROShard, os.path.join(dataset_opt['shard_root'], 'train')
+    else:
+        D_train, path = D, os.path.join(dataset_opt['data_root'], 'train')
+    train_set = D_train(path, dataset_opt['future_frames'], dataset_opt['past_frames'], dataset_opt['frames'], dataset_opt['patch_size'], dataset_opt['centralize'],
+                        dataset_opt['normalize'], False, False)
+    train_loader = DataLoader(train_set, shuffle=False, num_parallel_workers=dataset_opt['dataloader_num_workers'],
+                              column_names=train_set.column_names).batch(dataset_opt['dataloader_batch_size'], drop_remainder=True)
+    batches = []
+    for train_data in train_loader:
+        batches.append(train_data)
+        if len(batches) == args.batches:
+            break
+
+    '''
+    # ----------------------------------------
+    # Step--3 (benchmark)
+    # ----------------------------------------
+    '''
+
+    model = define_Model(opt)
+    model.init_train()
+
+    results = {}
+    for mode, jit in (('pynative', False), ('jit', True)):
+        train_step = TrainStep(model.train_net, model.G_optimizer, jit=jit)
+        step, first, loss = run_steps(model, train_step, batches, args.warmup)
+        results[mode] = step
+        info = train_step.info()
+        logger.info('{:>8s} | {:>8.1f} ms/step | first step {:>8.1f} ms | compiles {:d} | graph steps {:d} | loss {:.4e}{}'.format(
+            mode, step * 1000, first * 1000, info['compiles'], info['graph_steps'], loss,
+            ' | fell back: {}'.format(info['fallback']) if info['fallback'] else ''))
+    logger.info('jit speedup: {:.2f}x'.format(results['pynative'] / results['jit']))
+
+    if not opt['train']['E_decay']:
+        return
+    # EMA parity on the same start state, then the update cost
+    decay = 0.999
+    state = snapshot(model.netE)
+    ema = FusedEMA(model.netG, model.netE)
+    ema.update(decay)
+    fused = snapshot(model.netE)
+    restore(model.netE, state)
+    ema_reference(model.netG, model.netE, decay)
+    looped = snapshot(model.netE)
+    diff = max(float(np.abs(fused[k].astype(np.float64) - looped[k]).max()) for k in fused)
+    logger.info('EMA parity fused vs loop: max abs diff {:.3e}, parameters {}'.format(diff, ema.numel()))
+
+    restore(model.netE, state)  # in place, the fused update keeps no copy to resync
+    t_fused = time_updates(lambda: ema.update(decay), model.netE, args.ema_iters)
+    t_loop = time_updates(lambda: ema_reference(model.netG, model.netE, decay), model.netE, args.ema_iters)
+    restore(model.netE, state)
+    for k in args.ema_every:
+        logger.info('EMA every {:>3d} steps | fused {:>7.2f} ms/step | loop {:>7.2f} ms/step | {:.1%} of a jit step'.format(
+            k, t_fused / k * 1000, t_loop / k * 1000, t_fused / k / results['jit']))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,92 @@
+import os.path
+import argparse
+import logging
+import numpy as np
+
+from utils import utils_logger
+from utils import utils_image as util
+from utils import utils_option as option
+from utils import utils_video as video
+
+from models.select_model import define_Model
+
+import mindspore as ms
+
+
+'''
+# --------------------------------------------
+# streaming RS correction of a dual-RS video pair
+# t2b/b2t videos in -> GS video out, decoding and encoding overlap inference
+# --------------------------------------------
+'''
+
+
+def main(json_path='options/test_srsc_rsflow_multi_distillv2_real.json'):
+
+    '''
+    # ----------------------------------------
+    # Step--1 (prepare opt)
+    # ----------------------------------------
+    '''
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--opt', type=str, default=json_path, help='Path to option JSON file.')
+    parser.add_argument('--t2b', type=str, required=True, help='Top-to-bottom RS video.')
+    parser.add_argument('--b2t', type=str, required=True, help='Bottom-to-top RS video.')
+    parser.add_argument('--out', type=str, required=True, help='Output GS video.')
+    parser.add_argument('--times', type=float, nargs='+', default=None,
+                        help='Scan-times in [0, 1] per RS pair, default ext_frames evenly spaced ones.')
+    parser.add_argument('--fps', type=float, default=None, help='Output fps, default input fps x number of times.')
+    parser.add_argument('--batch', type=int, default=1, help='RS pairs per inference call.')
+    parser.add_argument('--queue_size', type=int, default=4, help='Batches buffered between the stages.')
+    args = parser.parse_args()
+
+    opt = option.parse(args.opt, is_train=True)
+    opt['dist'] = False
+    opt['rank'], opt['world_size'] = 0, 1
+    opt = option.dict_to_nonedict(opt)
+
+    logger_name = 'stream'
+    utils_logger.logger_info(logger_name, os.path.join(opt['path']['log'], logger_name+'.log'))
+    logger = logging.getLogger(logger_name)
+
+    dataset_opt = opt['datasets']['test']
+    times = args.times if args.times else np.linspace(0, 1, dataset_opt['frames']).tolist()
+    fps = args.fps if args.fps else video.video_fps(args.t2b) * len(times)
+    logger.info('times: {}, output fps: {:.2f}'.format(times, fps))
+
+    '''
+    # ----------------------------------------
+    # Step--2 (initialize model)
+    # ----------------------------------------
+    '''
+
+    model = define_Model(opt)
+    model.init_test()
+
+    def infer(rs):
+        # b, 2, h, w, 3 uint8 (BGR, like the dataset) -> b, len(times), h, w, 3 uint8
+        L = rs.astype(np.float32).transpose(0, 1, 4, 2, 3)
+        L = L - 255. / 2 if dataset_opt['centralize'] else L
+        L = L / 255. if dataset_opt['normalize'] else L
+        E = model.test_times(ms.Tensor(L), times).asnumpy()
+        E = E * 255. if dataset_opt['normalize'] else E
+        E = E + 255. / 2 if dataset_opt['centralize'] else E
+        return np.uint8(np.clip(E, 0, 255).round()).transpose(0, 1, 3, 4, 2)
+
+    '''
+    # ----------------------------------------
+    # Step--3 (stream)
+    # ----------------------------------------
+    '''
+
+    util.mkdir(os.path.dirname(os.path.abspath(args.out)))
+    pipeline = video.StreamPipeline(infer, batch_size=args.batch, queue_size=args.queue_size)
+    stats = pipeline.run(video.dual_video_frames(args.t2b, args.b2t), video.VideoSink(args.out, fps))
+    logger.info('{:d} RS pairs -> {:d} GS frames in {:.2f}s ({:.2f} pairs/s), inference {:.2f}s, waiting for decode {:.2f}s'.format(
+        stats['pairs'], stats['pairs'] * len(times), stats['time'], stats['pairs'] / max(stats['time'], 1e-8),
+        stats['infer_time'], stats['decode_wait']))
+
+
+if __name__ == '__main__':
+    main()
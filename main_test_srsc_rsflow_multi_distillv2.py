@@ -101,8 +101,7 @@ def main(json_path='options/test_srsc_rsflow_multi_distillv2_psnr.json'):
             test_set = D(path, dataset_opt['future_frames'], dataset_opt['past_frames'], dataset_opt['frames'], None, dataset_opt['centralize'],
                           dataset_opt['normalize'], flow, False, True)
             test_loader = DataLoader(test_set,shuffle=False, num_parallel_workers=1,
-                                     column_names=["rs_imgs", "gs_imgs", "fl_imgs", "prior_imgs", "time_rsc", "all_time_rsc", 
-                                                    "out_paths", "input_path"]).batch(batch_size=1, drop_remainder=False)
+                                     column_names=test_set.column_names).batch(batch_size=1, drop_remainder=False)
         else:
             raise NotImplementedError("Phase [%s] is not recognized." % phase)
 
@@ -113,7 +112,7 @@ def main(json_path='options/test_srsc_rsflow_multi_distillv2_psnr.json'):
     '''
 
     model = define_Model(opt)
-    model.init_train()
+    model.init_test()
     if opt['rank'] == 0:
         logger.info(model.info_network())
         logger.info(model.info_params())
@@ -130,7 +129,7 @@ def main(json_path='options/test_srsc_rsflow_multi_distillv2_psnr.json'):
 
     for test_data in test_loader:
         idx += 1
-        video_name = test_data[7].numpy()[0][0].split('/')[-3]
+        video_name = test_data[-1].numpy()[0][0].split('/')[-3]
 
         img_dir = os.path.join(opt['path']['inference_results'], video_name)
         util.mkdir(img_dir)
@@ -144,7 +143,7 @@ def main(json_path='options/test_srsc_rsflow_multi_distillv2_psnr.json'):
         current_psnr = 0
         current_ssim = 0
         for save_idx in range(len(E_img)):
-            image_name_ext = os.path.basename(test_data[7].numpy()[0][save_idx])
+            image_name_ext = os.path.basename(test_data[-1].numpy()[0][save_idx])
             img_name, ext = os.path.splitext(image_name_ext)
             save_img_path = os.path.join(img_dir, '{:s}.png'.format(img_name))
             util.imsave(E_img[save_idx], save_img_path)
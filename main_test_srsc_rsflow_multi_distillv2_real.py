@@ -122,8 +122,7 @@ def main(json_path='options/test_srsc_rsflow_multi_distillv2_real.json'):
             test_set = D(path, dataset_opt['future_frames'], dataset_opt['past_frames'], dataset_opt['frames'], None, dataset_opt['centralize'],
                           dataset_opt['normalize'], flow, False, True)
             test_loader = DataLoader(test_set,shuffle=False, num_parallel_workers=1,
-                                     column_names=["rs_imgs", "gs_imgs", "fl_imgs", "prior_imgs", "time_rsc", "all_time_rsc", 
-                                                    "out_paths", "input_path"]).batch(batch_size=1, drop_remainder=False)
+                                     column_names=test_set.column_names).batch(batch_size=1, drop_remainder=False)
         else:
             raise NotImplementedError("Phase [%s] is not recognized." % phase)
 
@@ -134,7 +133,7 @@ def main(json_path='options/test_srsc_rsflow_multi_distillv2_real.json'):
     '''
 
     model = define_Model(opt)
-    model.init_train()
+    model.init_test()
     # if opt['rank'] == 0:
     #     logger.info(model.info_network())
     #     logger.info(model.info_params())
@@ -151,8 +150,8 @@ def main(json_path='options/test_srsc_rsflow_multi_distillv2_real.json'):
     for test_data in test_loader:
         idx += 1
         # print(test_data[5][0])
-        video_name = test_data[7][0][0].split('/')[-2]
-        image_name_ext = os.path.basename(test_data[6][0][0])  # test_data[5][0][0]
+        video_name = test_data[-1][0][0].split('/')[-2]
+        image_name_ext = os.path.basename(test_data[-2][0][0])  # test_data[5][0][0]
         img_name, ext = os.path.splitext(image_name_ext)
 
         img_dir = os.path.join(opt['path']['inference_results'], video_name)
@@ -168,7 +167,7 @@ def main(json_path='options/test_srsc_rsflow_multi_distillv2_real.json'):
 
         # current_psnr = 0
         for save_idx in range(len(E_img)):
-            # image_name_ext = os.path.basename(test_data[7][save_idx][0])
+            # image_name_ext = os.path.basename(test_data[-1][save_idx][0])
             # img_name, ext = os.path.splitext(image_name_ext)
             save_img_path = os.path.join(img_dir, '{:s}_{:02d}.png'.format(img_name, save_idx)) #'E{:d}_{:d}.png'.format(save_idx,current_step)
             util.imsave(E_img[save_idx], save_img_path)
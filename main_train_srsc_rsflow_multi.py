@@ -14,6 +14,7 @@ from utils.utils_dist import get_dist_info, init_dist
 from models.select_model import define_Model
 
 from data.dataset_rsgopro_self import RSGOPRO as D
+from data.dataset_rsgopro_shard import RSGOPROShard
 
 import mindspore as ms
 import mindspore.dataset as ds
@@ -111,7 +112,12 @@ def main(json_path='options/train_srsc_rsflow_multi_psnr.json'):
             # flow = True
             # if not 'EPE' in para.loss:
             flow = False
-            train_set = D(path, dataset_opt['future_frames'], dataset_opt['past_frames'], dataset_opt['frames'], dataset_opt['patch_size'], dataset_opt['centralize'],
+            if dataset_opt['shard_root']:
+                # packed shards, see data/create_rs_shards.py
+                D_train, path = RSGOPROShard, os.path.join(dataset_opt['shard_root'], 'train')
+            else:
+                D_train = D
+            train_set = D_train(path, dataset_opt['future_frames'], dataset_opt['past_frames'], dataset_opt['frames'], dataset_opt['patch_size'], dataset_opt['centralize'],
                           dataset_opt['normalize'], flow, False)
             train_size = int(math.ceil(len(train_set) / dataset_opt['dataloader_batch_size']))
             if opt['rank'] == 0:
@@ -119,12 +125,12 @@ def main(json_path='options/train_srsc_rsflow_multi_psnr.json'):
             if opt['dist']:
                 train_loader = DataLoader(train_set,
                                           shuffle=False,
-                                          num_parallel_workers=dataset_opt['dataloader_num_workers']//opt['num_gpu'],column_names=["rs_imgs", "gs_imgs", "fl_imgs", "prior_imgs", "time_rsc", "all_time_rsc", "out_paths", "input_path"]
+                                          num_parallel_workers=dataset_opt['dataloader_num_workers']//opt['num_gpu'],column_names=train_set.column_names
                                           ,sampler=None).batch(dataset_opt['dataloader_batch_size']//opt['num_gpu'],drop_remainder=True)
             else:
                 train_loader = DataLoader(train_set,
                                           shuffle=dataset_opt['dataloader_shuffle'],
-                                          num_parallel_workers=dataset_opt['dataloader_num_workers'],column_names=["rs_imgs", "gs_imgs", "fl_imgs", "prior_imgs", "time_rsc", "all_time_rsc", "out_paths", "input_path"]).batch(dataset_opt['dataloader_batch_size'],drop_remainder=True)
+                                          num_parallel_workers=dataset_opt['dataloader_num_workers'],column_names=train_set.column_names).batch(dataset_opt['dataloader_batch_size'],drop_remainder=True)
 
         elif phase == 'test':
             # test_set = define_Dataset(dataset_opt)
@@ -135,8 +141,7 @@ def main(json_path='options/train_srsc_rsflow_multi_psnr.json'):
             test_set = D(path, dataset_opt['future_frames'], dataset_opt['past_frames'], dataset_opt['frames'], None, dataset_opt['centralize'],
                           dataset_opt['normalize'], flow, False, True)
             test_loader = DataLoader(test_set,shuffle=False, num_parallel_workers=1,
-                                     column_names=["rs_imgs", "gs_imgs", "fl_imgs", "prior_imgs", "time_rsc", "all_time_rsc", 
-                                                    "out_paths", "input_path"]).batch(batch_size=1, drop_remainder=False)# test_set = define_Dataset(dataset_opt)
+                                     column_names=test_set.column_names).batch(batch_size=1, drop_remainder=False)# test_set = define_Dataset(dataset_opt)
         else:
             raise NotImplementedError("Phase [%s] is not recognized." % phase)
 
@@ -209,7 +214,7 @@ def main(json_path='options/train_srsc_rsflow_multi_psnr.json'):
                 for test_data in test_loader:
                     idx += 1
                     # print(test_data[5][0])
-                    image_name_ext = os.path.basename(test_data[6][0][0])   #test_data[5][0][0]
+                    image_name_ext = os.path.basename(test_data[-2][0][0])   #test_data[5][0][0]
                     img_name, ext = os.path.splitext(image_name_ext)
 
                     img_dir = os.path.join(opt['path']['images'], img_name)
@@ -14,6 +14,8 @@ from utils.utils_dist import get_dist_info, init_dist
 from models.select_model import define_Model
 
 from data.dataset_rsgopro_self import RSGOPRO as D
+from data.dataset_rsgopro_shard import RSGOPROShard
+from data.prefetch_loader import PrefetchLoader
 
 import mindspore as ms
 import mindspore.dataset as ds
@@ -110,20 +112,30 @@ def main(json_path='options/train_srsc_rsflow_multi_distillv2_psnr.json'):
             # flow = True
             # if not 'EPE' in para.loss:
             flow = False
-            train_set = D(path, dataset_opt['future_frames'], dataset_opt['past_frames'], dataset_opt['frames'], dataset_opt['patch_size'], dataset_opt['centralize'],
-                          dataset_opt['normalize'], flow, False)
+            if dataset_opt['shard_root']:
+                # packed shards, see data/create_rs_shards.py
+                D_train, path = RSGOPROShard, os.path.join(dataset_opt['shard_root'], 'train')
+            else:
+                D_train = D
+            train_set = D_train(path, dataset_opt['future_frames'], dataset_opt['past_frames'], dataset_opt['frames'], dataset_opt['patch_size'], dataset_opt['centralize'],
+                          dataset_opt['normalize'], flow, False, crop_grid=dataset_opt['crop_grid'] or 1)
             train_size = int(math.ceil(len(train_set) / dataset_opt['dataloader_batch_size']))
             if opt['rank'] == 0:
                 logger.info('Number of train images: {:,d}, iters: {:,d}'.format(len(train_set), train_size))
-            if opt['dist']:
+            if dataset_opt['prefetch_loader'] and not opt['dist']:
+                # shared-memory batch slots filled by worker processes
+                train_loader = PrefetchLoader(train_set, dataset_opt['dataloader_batch_size'], shuffle=dataset_opt['dataloader_shuffle'],
+                                              num_workers=dataset_opt['dataloader_num_workers'], prefetch=dataset_opt['prefetch_depth'] or 2,
+                                              seed=dataset_opt['seed'] or 0)
+            elif opt['dist']:
                 train_loader = DataLoader(train_set,
                                           shuffle=False,
-                                          num_parallel_workers=dataset_opt['dataloader_num_workers']//opt['num_gpu'],column_names=["rs_imgs", "gs_imgs", "fl_imgs", "prior_imgs", "time_rsc", "all_time_rsc", "out_paths", "input_path"]
+                                          num_parallel_workers=dataset_opt['dataloader_num_workers']//opt['num_gpu'],column_names=train_set.column_names
                                           ,sampler=None).batch(dataset_opt['dataloader_batch_size']//opt['num_gpu'],drop_remainder=True)
             else:
                 train_loader = DataLoader(train_set,
                                           shuffle=dataset_opt['dataloader_shuffle'],
-                                          num_parallel_workers=dataset_opt['dataloader_num_workers'],column_names=["rs_imgs", "gs_imgs", "fl_imgs", "prior_imgs", "time_rsc", "all_time_rsc", "out_paths", "input_path"]).batch(dataset_opt['dataloader_batch_size'],drop_remainder=True)
+                                          num_parallel_workers=dataset_opt['dataloader_num_workers'],column_names=train_set.column_names).batch(dataset_opt['dataloader_batch_size'],drop_remainder=True)
 
         elif phase == 'test':
             # test_set = define_Dataset(dataset_opt)
@@ -134,8 +146,7 @@ def main(json_path='options/train_srsc_rsflow_multi_distillv2_psnr.json'):
             test_set = D(path, dataset_opt['future_frames'], dataset_opt['past_frames'], dataset_opt['frames'], None, dataset_opt['centralize'],
                           dataset_opt['normalize'], flow, False, True)
             test_loader = DataLoader(test_set,shuffle=False, num_parallel_workers=1,
-                                     column_names=["rs_imgs", "gs_imgs", "fl_imgs", "prior_imgs", "time_rsc", "all_time_rsc", 
-                                                    "out_paths", "input_path"]).batch(batch_size=1, drop_remainder=False)# test_set = define_Dataset(dataset_opt)
+                                     column_names=test_set.column_names).batch(batch_size=1, drop_remainder=False)# test_set = define_Dataset(dataset_opt)
         else:
             raise NotImplementedError("Phase [%s] is not recognized." % phase)
 
@@ -208,7 +219,7 @@ def main(json_path='options/train_srsc_rsflow_multi_distillv2_psnr.json'):
                 for test_data in test_loader:
                     idx += 1
                     # print(test_data[5][0])
-                    image_name_ext = os.path.basename(test_data[6][0][0])   #test_data[5][0][0]
+                    image_name_ext = os.path.basename(test_data[-2][0][0])   #test_data[5][0][0]
                     img_name, ext = os.path.splitext(image_name_ext)
 
                     img_dir = os.path.join(opt['path']['images'], img_name)
@@ -253,5 +264,14 @@ def main(json_path='options/train_srsc_rsflow_multi_distillv2_psnr.json'):
                 # testing log
                 logger.info('<epoch:{:3d}, iter:{:8,d}, Average PSNR : {:<.2f}dB\n'.format(epoch, current_step, avg_psnr))
 
+        if model.teacher_cache is not None and opt['rank'] == 0:
+            stats = model.teacher_cache.info()
+            logger.info('<epoch:{:3d}> teacher cache: {:d} hits, {:d} misses ({:.1%}), {:.2f} GB, {:d} evictions'.format(
+                epoch, stats['hits'], stats['misses'], stats['hit_rate'], stats['bytes'] / (1 << 30), stats['evictions']))
+        if isinstance(train_loader, PrefetchLoader) and opt['rank'] == 0:
+            stats = train_loader.stats()
+            logger.info('<epoch:{:3d}> input stall: {:.2f}s this epoch, {:.1f}ms/batch over {:d} batches'.format(
+                epoch, stats['stall_time'], stats['stall_per_batch'] * 1000, stats['num_batches']))
+
 if __name__ == '__main__':
     main()
@@ -0,0 +1,92 @@
+"""
+Exponential moving average of netG parameters into netE
+
+The update is one compiled graph that maps a lerp and an assign over all (netE, netG) parameter pairs,
+netE is written in place and no copy of the parameters is kept, so loading or editing netE between
+updates needs no resync. The netG parameters are inputs of the graph and not graph parameters,
+netG and netE share their parameter names.
+"""
+
+import mindspore as ms
+import mindspore.nn as nn
+import mindspore.ops as O
+
+
+FLOAT_TYPES = (ms.float16, ms.float32, ms.float64)
+
+_ema_lerp = O.MultitypeFuncGraph('ema_lerp')
+_ema_copy = O.MultitypeFuncGraph('ema_copy')
+
+
+@_ema_lerp.register('Tensor', 'Tensor', 'Tensor')
+def _lerp(weight, E_param, G_param):
+    return O.assign(E_param, O.lerp(E_param, G_param, weight.astype(E_param.dtype)))
+
+
+@_ema_copy.register('Tensor', 'Tensor')
+def _copy(E_param, G_param):
+    return O.assign(E_param, G_param)
+
+
+class EMACell(nn.Cell):
+    """in-place EMA of the E_params, construct(weight, G_params) does E = E + weight * (G - E)"""
+
+    def __init__(self, E_params):
+        super(EMACell, self).__init__(auto_prefix=False)
+        self.E_params = ms.ParameterTuple(E_params)
+        self.hyper_map = O.HyperMap()
+
+    def construct(self, weight, G_params):
+        return self.hyper_map(O.partial(_ema_lerp, weight), self.E_params, G_params)
+
+    def copy(self, G_params):
+        return self.hyper_map(_ema_copy, self.E_params, G_params)
+
+
+class FusedEMA:
+    """
+    Parameters:
+        netG: trained network
+        netE: averaged network with the same parameter names
+
+    update(decay) does netE = decay * netE + (1 - decay) * netG, decay 0 copies netG.
+    """
+
+    def __init__(self, netG, netE):
+        G_params = dict(netG.parameters_and_names())
+        E_list, G_list = [], []
+        for name, param in netE.parameters_and_names():
+            if param.dtype in FLOAT_TYPES:
+                E_list.append(param)
+                G_list.append(G_params[name])
+        self.G_params = tuple(G_list)
+        self.cell = EMACell(E_list)
+        cell = self.cell
+
+        def lerp(weight, G_params):
+            return cell(weight, G_params)
+
+        def copy(G_params):
+            return cell.copy(G_params)
+        self.lerp = ms.jit(lerp)
+        self.copy = ms.jit(copy)
+
+    def update(self, decay):
+        if decay == 0:
+            self.copy(self.G_params)
+        else:
+            self.lerp(ms.Tensor(1. - decay, ms.float32), self.G_params)  # a tensor, other decays reuse the graph
+
+    def numel(self):
+        numel = {}
+        for param in self.cell.E_params:
+            numel[str(param.dtype)] = numel.get(str(param.dtype), 0) + int(param.size)
+        return numel
+
+
+def ema_reference(netG, netE, decay):
+    """one EMA update parameter by parameter, for parity checks and benchmarks"""
+    G_params = dict(netG.parameters_and_names())
+    for name, param in netE.parameters_and_names():
+        if param.dtype in FLOAT_TYPES:
+            param.set_data(param * decay + G_params[name] * (1. - decay))
@@ -1,14 +1,69 @@
 import math
+import numpy as np
 import mindspore as ms
 import mindspore.nn as nn
 import mindspore.ops as O
 from models.pwcnet_model import PWCNet
 from models.pwc_modules import WarpingLayer as Warp
+from models.warplayer import masked_warp
+
+'''
+# --------------------------------------------
+# reduced-precision frozen teacher
+# fp16: parameters and activations in float16
+# int8: conv weights in int8 (symmetric, per output channel), dequantized to float16 on the fly
+# --------------------------------------------
+'''
+
+
+class QuantConv2d(nn.Cell):
+    """frozen nn.Conv2d with int8 weights, computes in dtype"""
+    def __init__(self, conv, dtype=ms.float16):
+        super(QuantConv2d, self).__init__()
+        w = conv.weight.asnumpy()
+        scale = np.maximum(np.abs(w).reshape(w.shape[0], -1).max(axis=1) / 127., 1e-12).reshape(-1, 1, 1, 1)
+        self.weight_int8 = ms.Parameter(ms.Tensor(np.round(w / scale).astype(np.int8)),
+                                        name=conv.weight.name + '_int8', requires_grad=False)
+        self.weight_scale = ms.Parameter(ms.Tensor(scale, dtype), name=conv.weight.name + '_scale', requires_grad=False)
+        self.bias = ms.Parameter(conv.bias.astype(dtype), name=conv.bias.name, requires_grad=False) if conv.has_bias else None
+        self.stride, self.pad_mode, self.padding = conv.stride, conv.pad_mode, conv.padding
+        self.dilation, self.group = conv.dilation, conv.group
+
+    def construct(self, x):
+        weight = self.weight_int8.astype(self.weight_scale.dtype) * self.weight_scale
+        return O.conv2d(x, weight, self.bias, self.stride, self.pad_mode, self.padding, self.dilation, self.group)
+
+
+def quantize_int8(cell, dtype=ms.float16):
+    """replaces every nn.Conv2d below cell by a QuantConv2d, in place"""
+    for name, child in cell.name_cells().items():
+        if isinstance(child, nn.Conv2d):
+            if isinstance(cell, (nn.SequentialCell, nn.CellList)):
+                cell[int(name)] = QuantConv2d(child, dtype)
+            else:
+                setattr(cell, name, QuantConv2d(child, dtype))
+        else:
+            quantize_int8(child, dtype)
+    return cell
+
+
+def cast_params(cell, dtype=ms.float16):
+    """stores the floating point parameters of cell in dtype, frozen, in place"""
+    for _, sub in cell.cells_and_names():
+        for param in list(sub.get_parameters(expand=False)):
+            if param.dtype in (ms.float32, ms.float64):
+                setattr(sub, param.name.split('.')[-1], ms.Parameter(param.astype(dtype), name=param.name, requires_grad=False))
+    return cell
+
 
 class Flow_PWC(nn.Cell):
-    def __init__(self, load_pretrain=False, pretrain_fn=''):
+    def __init__(self, load_pretrain=False, pretrain_fn='', scale=1.0, output_level=None, precision='fp32'):
         super(Flow_PWC, self).__init__()
         self.moduleNetwork = PWCNet()
+        self.scale = scale  # working resolution relative to the input frames
+        self.output_level = output_level  # decoder stopping level, None for the full PWCNet.output_level
+        self.precision = precision  # 'fp32' | 'fp16' | 'int8', applied after loading the weights
+        self.dtype = ms.float32
         print("Creating Flow PWC")
 
         if load_pretrain:
@@ -32,20 +87,45 @@ class Flow_PWC(nn.Cell):
             print('Loading Flow PWC pretrain model from {}'.format(pretrain_fn))
             self.moduleNetwork.set_train(False)
 
+        assert precision in ('fp32', 'fp16', 'int8'), precision
+        if precision != 'fp32':
+            self.dtype = ms.float16
+            if precision == 'int8':
+                quantize_int8(self.moduleNetwork, self.dtype)
+            cast_params(self.moduleNetwork, self.dtype)
+            print('Flow PWC teacher in {}'.format(precision))
+
     def estimate_flow(self, tensorFirst, tensorSecond):
-        b, c, intHeight, intWidth = tensorFirst.shape
+        return self.estimate_flows([tensorFirst, tensorSecond], [(0, 1)])[0]
+
+    def estimate_flows(self, frames, pairs):
+        """
+        flows of several ordered frame pairs, every frame is resized and its pyramid extracted once,
+        the decoder runs on all pairs as one batch
+            frames: list of [B, C, H, W]
+            pairs: list of (i, j), flow from frames[i] to frames[j]
+        returns: list of [B, 2, H, W], one per pair
+        the frames are processed at self.scale of their size (rounded up to a multiple of 64),
+        the decoder stops at self.output_level, runs in self.dtype and the flows are returned in float32
+        """
+        b, c, intHeight, intWidth = frames[0].shape
+
+        intPreprocessedWidth = int(math.floor(math.ceil(intWidth * self.scale / 64.0) * 64.0))
+        intPreprocessedHeight = int(math.floor(math.ceil(intHeight * self.scale / 64.0) * 64.0))
 
-        intPreprocessedWidth = int(math.floor(math.ceil(intWidth / 64.0) * 64.0))
-        intPreprocessedHeight = int(math.floor(math.ceil(intHeight / 64.0) * 64.0))
+        tensorPreprocessed = O.interpolate(input=O.cat(frames, axis=0).astype(self.dtype),
+                                           size=(intPreprocessedHeight, intPreprocessedWidth),
+                                           mode='bilinear', align_corners=False)
+        pyramid = self.moduleNetwork.extract(tensorPreprocessed)
 
-        tensorPreprocessedFirst = O.interpolate(input=tensorFirst,
-                                                size=(intPreprocessedHeight, intPreprocessedWidth),
-                                                mode='bilinear', align_corners=False)
-        tensorPreprocessedSecond = O.interpolate(input=tensorSecond,
-                                                 size=(intPreprocessedHeight, intPreprocessedWidth),
-                                                 mode='bilinear', align_corners=False)
+        def _gather(level, ids):
+            return O.cat([level[k * b:(k + 1) * b] for k in ids], axis=0)
 
-        outputFlow = self.moduleNetwork(tensorPreprocessedFirst, tensorPreprocessedSecond)
+        firsts = [i for i, _ in pairs]
+        seconds = [j for _, j in pairs]
+        outputFlow = self.moduleNetwork.decode([_gather(level, firsts) for level in pyramid],
+                                               [_gather(level, seconds) for level in pyramid],
+                                               output_level=self.output_level).astype(ms.float32)
 
         tensorFlow = 20.0 * O.interpolate(input=outputFlow, size=(intHeight, intWidth),
                                           mode='bilinear', align_corners=False)
@@ -53,7 +133,7 @@ class Flow_PWC(nn.Cell):
         tensorFlow[:, 0, :, :] *= float(intWidth) / float(intPreprocessedWidth)
         tensorFlow[:, 1, :, :] *= float(intHeight) / float(intPreprocessedHeight)
 
-        return tensorFlow
+        return O.chunk(tensorFlow, len(pairs), axis=0)
 
     def warp(self, x, flo):
         """
@@ -61,31 +141,7 @@ class Flow_PWC(nn.Cell):
             x: [B, C, H, W] (im2)
             flo: [B, 2, H, W] flow
         """
-        B, C, H, W = x.shape
-        # mesh grid
-        xx = O.arange(0, W).view(1, -1).repeat(H, 1)
-        yy = O.arange(0, H).view(-1, 1).repeat(1, W)
-        xx = xx.view(1, 1, H, W).repeat(B, 1, 1, 1)
-        yy = yy.view(1, 1, H, W).repeat(B, 1, 1, 1)
-        grid = O.cat((xx, yy), 1).float()
-        #grid = grid.to(self.device)
-        vgrid = grid + flo
-
-        # scale grid to [-1,1]
-        vgrid[:, 0, :, :] = 2.0 * vgrid[:, 0, :, :].clone() / max(W - 1, 1) - 1.0
-        vgrid[:, 1, :, :] = 2.0 * vgrid[:, 1, :, :].clone() / max(H - 1, 1) - 1.0
-
-        vgrid = vgrid.permute(0, 2, 3, 1)
-        output = O.grid_sample(x, vgrid, padding_mode='border')
-        mask = O.ones(x.shape)
-        mask = O.grid_sample(mask, vgrid)
-
-        mask[mask < 0.999] = 0
-        mask[mask > 0] = 1
-
-        output = output * mask
-
-        return output, mask
+        return masked_warp(x, flo)
     
     def construct(self, frame_1, frame_2):
         # flow
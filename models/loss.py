@@ -1,8 +1,11 @@
+import os
+
 import mindspore as ms
 import mindspore.nn as nn
 import mindspore.ops as O
 import numpy as np
-import mindcv
+
+from utils import utils_cache
 """
 Sequential(
       (0): Conv2d(3, 64, kernel_size=(3, 3), stride=(1, 1), padding=(1, 1))
@@ -67,7 +70,7 @@ class CharbonnierLoss(nn.Cell):
         loss = O.mean(O.sqrt((diff * diff) + self.eps))
         return loss
 
-class Charbonnier:
+class Charbonnier(nn.Cell):
     # def __init__(self, args):
     #     self.epsilon = 1e-6
     #
@@ -75,44 +78,113 @@ class Charbonnier:
     #     return (((pred - gt) ** 2 + self.epsilon) ** 0.5).mean()
 
     def __init__(self, args):
-        # super(CharbonnierLoss, self).__init__()
+        super(Charbonnier, self).__init__()
         self.eps = 1e-9
 
-    def __call__(self, x, y):
+    def construct(self, x, y):
         diff = x - y
         loss = O.mean(O.sqrt((diff * diff) + self.eps))
         return loss
 
 
+# --------------------------------------------
+# truncated VGG19 features
+# only the conv weights up to conv3_3 (features.0 - features.14) are built and loaded,
+# from a pre-sliced checkpoint in the cache directory; the slice is taken once from the
+# mindcv vgg19 checkpoint, the classifier and the deeper conv layers are never materialized
+# --------------------------------------------
+VGG19_CFG = [64, 64, 'M', 128, 128, 'M', 256, 256, 256, 256, 'M', 512, 512, 512, 512, 'M', 512, 512, 512, 512, 'M']
+CONV_3_3_LAYER = 14
+
+
+def vgg19_layers(last_layer=CONV_3_3_LAYER):
+    """vgg19 feature layers 0 - last_layer, same layout and parameter names as mindcv features.*"""
+    layers, in_channels = [], 3
+    for v in VGG19_CFG:
+        if v == 'M':
+            layers.append(nn.MaxPool2d(kernel_size=2, stride=2))
+        else:
+            layers += [nn.Conv2d(in_channels, v, kernel_size=3, pad_mode='pad', padding=1, has_bias=True), nn.ReLU()]
+            in_channels = v
+        if len(layers) > last_layer:
+            break
+    return nn.SequentialCell(layers[:last_layer + 1])
+
+
+def slice_vgg19(ckpt_path, last_layer=CONV_3_3_LAYER):
+    """
+    write the conv weights of mindcv vgg19 features 0 - last_layer to ckpt_path
+    the pretrained checkpoint is read with a name filter, so only the kept tensors are loaded
+    """
+    from mindcv.models.vgg import default_cfgs
+    from mindcv.utils.download import DownLoad, get_default_download_root
+
+    def keep(name):
+        parts = name.split('.')
+        return parts[0] == 'features' and int(parts[1]) <= last_layer
+
+    url = default_cfgs['vgg19']['url']
+    root = os.path.join(get_default_download_root(), 'models')
+    DownLoad().download_url(url, path=root)
+    param_dict = ms.load_checkpoint(os.path.join(root, os.path.basename(url)), choice_func=keep)
+    params = [{'name': name[len('features.'):], 'data': param} for name, param in param_dict.items() if keep(name)]
+    utils_cache.atomic_save(ckpt_path, lambda tmp_path: ms.save_checkpoint(params, tmp_path))
+
+
+def vgg19_features(ckpt_path=None, last_layer=CONV_3_3_LAYER):
+    """frozen vgg19 features 0 - last_layer, loaded from the pre-sliced checkpoint, sliced first if missing"""
+    ckpt_path = ckpt_path or utils_cache.cache_path('vgg19_features_{}.ckpt'.format(last_layer))
+    if not os.path.exists(ckpt_path):
+        slice_vgg19(ckpt_path, last_layer)
+    model = vgg19_layers(last_layer)
+    not_loaded, _ = ms.load_param_into_net(model, ms.load_checkpoint(ckpt_path), strict_load=True)
+    if not_loaded:
+        raise ValueError('{} misses VGG19 parameters {}'.format(ckpt_path, not_loaded))
+    for param in model.get_parameters():
+        param.requires_grad = False
+    model.set_train(False)
+    return model
+
+
 def Perceptual(args):
-    return PerceptualLoss(loss=nn.L1Loss())
-
-
-class PerceptualLoss:
-    def contentFunc(self):
-        conv_3_3_layer = 14
-        vgg19=mindcv.create_model("vgg19",pretrained=True)
-        cnn = vgg19.name_cells()['features']
-        model = nn.SequentialCell([])
-        #model = model.cuda()
-        for i,layer in enumerate(cnn.cells()):
-            model.append(layer)
-            if i == conv_3_3_layer:
-                break
-        return model
-
-    def __init__(self, loss):
+    # built by define_loss, the VGG is loaded here and not inside the first (compiled) training step
+    return PerceptualLoss(loss=nn.L1Loss(), ckpt_path=args['perceptual_ckpt'] if args else None).build()
+
+
+class PerceptualLoss(nn.Cell):
+    """
+    L1 distance of VGG19 conv3_3 features
+    the VGG is loaded by build(), which has to run before the loss is first called
+    """
+
+    def __init__(self, loss, ckpt_path=None):
+        super(PerceptualLoss, self).__init__()
         self.criterion = loss
-        self.contentFunc = self.contentFunc()
-
-    def __call__(self, fake_img, real_img):
-        n, c, h, w = fake_img.shape
-        fake_img = fake_img.reshape(n * int(c / 3), 3, h, w)
-        real_img = real_img.reshape(n * int(c / 3), 3, h, w)
-        f_fake = self.contentFunc(fake_img)
-        f_real = self.contentFunc(real_img)
-        f_real_no_grad = f_real
-        loss = self.criterion(f_fake, f_real_no_grad)
+        self.ckpt_path = ckpt_path
+        self.contentFunc = None
+
+    def build(self):
+        if self.contentFunc is None:
+            self.contentFunc = vgg19_features(self.ckpt_path)
+        return self
+
+    def construct(self, fake_img, real_img):
+        return self.multi([fake_img], [real_img], [0])
+
+    def multi(self, fake_imgs, real_imgs, real_index):
+        """
+        sum of the losses of several terms with a single VGG forward
+            fake_imgs: list of (n, 3k, h, w) predictions, all of the same h, w
+            real_imgs: list of the distinct targets, encoded once and without gradient
+            real_index: target of each prediction, fake_imgs[i] is compared with real_imgs[real_index[i]]
+        """
+        h, w = fake_imgs[0].shape[-2:]
+        imgs = [img.reshape(-1, 3, h, w) for img in fake_imgs + real_imgs]
+        feats = O.split(self.contentFunc(O.cat(imgs, axis=0)), [img.shape[0] for img in imgs], axis=0)
+        f_reals = [O.stop_gradient(f) for f in feats[len(fake_imgs):]]
+        loss = self.criterion(feats[0], f_reals[real_index[0]])
+        for i in range(1, len(fake_imgs)):
+            loss = loss + self.criterion(feats[i], f_reals[real_index[i]])
         return loss
 
 class GridGradientCentralDiff(nn.Cell):
@@ -216,3 +288,31 @@ def loss_parse(loss_str):
         ratios.append(float(substr_temp[0]))
         losses.append(substr_temp[1])
     return ratios, losses
+
+
+if __name__ == '__main__':
+    # parity of the single-forward multi-term perceptual loss with one call per term
+    loss_fn = Perceptual(None)
+    ref0, ref1 = [ms.Tensor(np.random.rand(2, 3, 64, 64).astype(np.float32)) for _ in range(2)]
+    E_ori = ms.Tensor(np.random.rand(2, 9, 64, 64).astype(np.float32))
+    fakes = [ms.Tensor(np.random.rand(2, 3, 64, 64).astype(np.float32)) for _ in range(4)]
+    fakes.append(ms.Tensor(np.random.rand(2, 9, 64, 64).astype(np.float32)))
+    reals = [ref0, ref0, ref1, ref1, E_ori]
+    looped = sum(loss_fn(fake, real).asnumpy() for fake, real in zip(fakes, reals))
+    batched = loss_fn.multi(fakes, [ref0, ref1, E_ori], [0, 0, 1, 1, 2]).asnumpy()
+    print('perceptual loss looped {:.6f}, batched {:.6f}'.format(float(looped), float(batched)))
+    assert abs(looped - batched) < 1e-4 * max(abs(looped), 1), (looped, batched)
+
+    # the truncated features match the first layers of the full mindcv vgg19
+    import mindcv
+    full = mindcv.create_model('vgg19', pretrained=True).name_cells()['features']
+    full.set_train(False)
+    x = ms.Tensor(np.random.rand(2, 3, 64, 64).astype(np.float32))
+    y = x
+    for i, layer in enumerate(full.cells()):
+        y = layer(y)
+        if i == CONV_3_3_LAYER:
+            break
+    diff = float(np.abs(loss_fn.contentFunc(x).asnumpy() - y.asnumpy()).max())
+    print('truncated vs full vgg19 features: max abs diff {:.3e}'.format(diff))
+    assert diff < 1e-5, diff
@@ -2,6 +2,7 @@ import os
 from utils.utils_bnorm import merge_bn, tidy_sequential
 import mindspore as ms
 import mindspore.nn as nn
+from models.ema import FusedEMA
 
 class ModelBase():
     def __init__(self, opt):
@@ -221,11 +222,10 @@ class ModelBase():
         optimizer.load_state_dict(torch.load(load_path, map_location=lambda storage, loc: storage.cuda(torch.cuda.current_device())))
 
     def update_E(self, decay=0.999):
-        netG = self.get_bare_model(self.netG)
-        netG_params = dict(netG.parameters_dict())
-        netE_params = dict(self.netE.parameters_dict())
-        for k in netG_params.keys():
-            netE_params[k].data.mul(decay).add(netG_params[k].data)*(1-decay)
+        """netE = decay * netE + (1 - decay) * netG in place in one compiled update, decay 0 copies netG"""
+        if getattr(self, 'ema', None) is None:
+            self.ema = FusedEMA(self.get_bare_model(self.netG), self.netE)
+        self.ema.update(decay)
 
     """
     # ----------------------------------------
@@ -7,7 +7,8 @@ from mindspore.experimental import optim
 from models.select_network import define_G
 from models.model_plain import ModelPlain
 from models.flow_pwc import Flow_PWC as net
-from models.network_rsgenerator import CFR_flow_t_align
+from models.network_rsgenerator import CFR_blend_batch
+from models.warplayer import masked_warp
 from utils.utils_model import test_mode
 from utils.utils_regularizers import regularizer_orth, regularizer_clip
 
@@ -31,7 +32,10 @@ class ModelSRSCRSG(ModelPlain):
         self.fix_iter = self.opt_train.get('fix_iter', 0)
         self.fix_keys = self.opt_train.get('fix_keys', [])
         self.fix_unflagged = True
-        self.net_rsg = net(load_pretrain=True, pretrain_fn=self.opt['path']['pretrained_rsg'])
+        self.net_rsg = net(load_pretrain=True, pretrain_fn=self.opt['path']['pretrained_rsg'],
+                           scale=self.opt_train.get('teacher_scale', 1.0),  # teacher working resolution
+                           output_level=self.opt_train.get('teacher_output_level', None),  # teacher stopping level
+                           precision=self.opt_train.get('teacher_precision', 'fp32'))  # fp32 | fp16 | int8
         self.net_rsg = self.model_to_device(self.net_rsg)
         # print('Loading model for RS Generator [{:s}] ...'.format(self.opt['path']['pretrained_rsg']))
         # self.load_network(self.opt['path']['pretrained_rsg'], self.net_rsg, strict=True, param_key='params')
@@ -55,6 +59,15 @@ class ModelSRSCRSG(ModelPlain):
         self.define_scheduler()               # define scheduler
         self.log_dict = OrderedDict()         # log
 
+    # ----------------------------------------
+    # initialize inference only
+    # no loss, optimizer or scheduler
+    # ----------------------------------------
+    def init_test(self):
+        self.load()                           # load model
+        self.netG.set_train(False)            # set evaluation mode
+        self.log_dict = OrderedDict()         # log
+
     # ----------------------------------------
     # load pre-trained G model
     # ----------------------------------------
@@ -205,7 +218,9 @@ class ModelSRSCRSG(ModelPlain):
         # self.L = data['L'].to(self.device)
         # if need_H:
         #     self.H = data['H'].to(self.device)
-        self.L, self.H, self.H_flows, self.dis_encodings, self.time_rsc, self.all_time_rsc, self.out_path, self.input_path = data   #rs_imgs, gs_imgs, fl_imgs, prior_imgs, time_rsc, out_paths, input_path
+        data = list(data)
+        self.H_flows = data.pop(2) if len(data) == 9 else None  # fl_imgs is only in the columns with flow supervision
+        self.L, self.H, self.dis_encodings, self.time_rsc, self.all_time_rsc, self.crop_info, self.out_path, self.input_path = data   #rs_imgs, gs_imgs, prior_imgs, time_rsc, all_time_rsc, crop_info, out_paths, input_path
         #self.L = self.L.to(self.device)
         #self.H = self.H.to(self.device)
         # self.H_flows = self.H_flows.to(self.device)
@@ -253,30 +268,7 @@ class ModelSRSCRSG(ModelPlain):
             x: [B, C, H, W] (im2)
             flo: [B, 2, H, W] flow
         """
-        B, C, H, W = x.shape
-        # mesh grid
-        xx = O.arange(0, W).view(1, -1).repeat(H, 1)
-        yy = O.arange(0, H).view(-1, 1).repeat(1, W)
-        xx = xx.view(1, 1, H, W).repeat(B, 1, 1, 1)
-        yy = yy.view(1, 1, H, W).repeat(B, 1, 1, 1)
-        grid = O.cat((xx, yy), 1).float()
-        grid = grid.to(self.device)
-        vgrid = grid + flo
-
-        # scale grid to [-1,1]
-        vgrid[:, 0, :, :] = 2.0 * vgrid[:, 0, :, :].clone() / max(W - 1, 1) - 1.0
-        vgrid[:, 1, :, :] = 2.0 * vgrid[:, 1, :, :].clone() / max(H - 1, 1) - 1.0
-
-        vgrid = vgrid.permute(0, 2, 3, 1)
-        output = O.grid_sample(x, vgrid, padding_mode='border')
-        mask = O.ones(x.shape)
-        mask = O.grid_sample(mask, vgrid)
-
-        mask[mask < 0.999] = 0
-        mask[mask > 0] = 1
-
-        output = output * mask
-
+        output, _ = masked_warp(x, flo)
         return output
 
     def netG_forward(self, is_train=True):
@@ -329,35 +321,22 @@ class ModelSRSCRSG(ModelPlain):
             mid_mask1 = self.dis_encodings1[:, 0, 2]   #t2b
             mid_mask2 = self.dis_encodings2[:, 0, 2]   #b2t
 
-            self.flow02 = self.net_rsg(self.E[:, 0], self.E[:, 2])
-            self.flow20 = self.net_rsg(self.E[:, 2], self.E[:, 0])
-            self.flow01 = self.net_rsg(self.E[:, 0], self.E[:, 1])
-            self.flow10 = self.net_rsg(self.E[:, 1], self.E[:, 0])
-            self.flow12 = self.net_rsg(self.E[:, 1], self.E[:, 2])
-            self.flow21 = self.net_rsg(self.E[:, 2], self.E[:, 1])
-
-            # whole
-            ft0, ft2 = CFR_flow_t_align('cuda', self.flow02, self.flow20, time_coding1)
-            self.L_t2b = (1 - time_coding1) * self.warp(self.E[:, 0], ft0) + time_coding1 * self.warp(self.E[:, 2], ft2)  #* occ_0   * occ_1
-            ft0, ft2 = CFR_flow_t_align('cuda', self.flow02, self.flow20, time_coding2)
-            self.L_b2t = (1 - time_coding2) * self.warp(self.E[:, 0], ft0) + time_coding2 * self.warp(self.E[:, 2], ft2)  #* occ_0   * occ_1
-
-            # 0-1, 1-2
-            ft0_f, ft1_f = CFR_flow_t_align('cuda', self.flow01, self.flow10, mid_time_coding1_up)
-            warped_img_f = (1 - mid_time_coding1_up) * self.warp(self.E[:, 0], ft0_f) + mid_time_coding1_up * self.warp(self.E[:, 1], ft1_f)
-            warped_img_f = warped_img_f * mid_mask1
-            ft1_b, ft2_b = CFR_flow_t_align('cuda', self.flow12, self.flow21, mid_time_coding1_down)
-            warped_img_b = (1 - mid_time_coding1_down) * self.warp(self.E[:, 1], ft1_b) + mid_time_coding1_down * self.warp(self.E[:, 2], ft2_b)
-            warped_img_b = warped_img_b * (1 - mid_mask1)
-            self.L_t2b_mid = warped_img_b + warped_img_f
-
-            ft0_f, ft1_f = CFR_flow_t_align('cuda', self.flow01, self.flow10, mid_time_coding2_up)
-            warped_img_f = (1 - mid_time_coding2_up) * self.warp(self.E[:, 0], ft0_f) + mid_time_coding2_up * self.warp(self.E[:, 1], ft1_f)
-            warped_img_f = warped_img_f * mid_mask2
-            ft1_b, ft2_b = CFR_flow_t_align('cuda', self.flow12, self.flow21, mid_time_coding2_down)
-            warped_img_b = (1 - mid_time_coding2_down) * self.warp(self.E[:, 1], ft1_b) + mid_time_coding2_down * self.warp(self.E[:, 2], ft2_b)
-            warped_img_b = warped_img_b * (1 - mid_mask2)
-            self.L_b2t_mid = warped_img_b + warped_img_f
+            # each frame's pyramid is extracted once, the 6 pairs are decoded as one batch
+            self.flow02, self.flow20, self.flow01, self.flow10, self.flow12, self.flow21 = self.net_rsg.estimate_flows(
+                [self.E[:, 0], self.E[:, 1], self.E[:, 2]], [(0, 2), (2, 0), (0, 1), (1, 0), (1, 2), (2, 1)])
+
+            # whole (t2b, b2t), 0-1 and 1-2 (t2b, b2t), all in one batch
+            E0, E1, E2 = self.E[:, 0], self.E[:, 1], self.E[:, 2]
+            L_t2b, L_b2t, f_t2b, b_t2b, f_b2t, b_b2t = CFR_blend_batch(
+                'cuda',
+                [E0, E0, E0, E1, E0, E1],
+                [E2, E2, E1, E2, E1, E2],
+                [self.flow02, self.flow02, self.flow01, self.flow12, self.flow01, self.flow12],
+                [self.flow20, self.flow20, self.flow10, self.flow21, self.flow10, self.flow21],
+                [time_coding1, time_coding2, mid_time_coding1_up, mid_time_coding1_down, mid_time_coding2_up, mid_time_coding2_down])
+            self.L_t2b, self.L_b2t = L_t2b, L_b2t  #* occ_0   * occ_1
+            self.L_t2b_mid = f_t2b * mid_mask1 + b_t2b * (1 - mid_mask1)
+            self.L_b2t_mid = f_b2t * mid_mask2 + b_b2t * (1 - mid_mask2)
 
         if ori_h % 32 != 0 or ori_w % 32 != 0:
             if is_train:
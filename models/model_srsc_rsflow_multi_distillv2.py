@@ -1,4 +1,5 @@
 from collections import OrderedDict
+import numpy as np
 import mindspore as ms
 import mindspore.nn as nn
 import mindspore.ops as O
@@ -7,8 +8,12 @@ from mindspore.experimental import optim
 from models.select_network import define_G
 from models.model_plain import ModelPlain
 from models.flow_pwc import Flow_PWC as net
-from models.network_rsgenerator import CFR_flow_t_align
-from utils.utils_model import test_mode
+from models.network_rsgenerator import CFR_blend_batch
+from models.warplayer import masked_warp
+from models.network_srsc_rsg import time_encoding, time_frames
+from models.train_step import TrainStep, enable_compile_cache
+from models.teacher_cache import TeacherCache, fingerprint
+from utils.utils_model import test_mode, test_tile
 from utils.utils_regularizers import regularizer_orth, regularizer_clip
 import time
 try:
@@ -16,6 +21,117 @@ try:
 except:
     from loss import *
 
+
+def loss_kind(name):
+    """branch of a G_lossfn_type entry in DistillTrainNet.G_losses"""
+    name = name.lower()
+    for kind in ('epe', 'variation', 'perceptual'):
+        if name.startswith(kind):
+            return kind
+    return 'pixel'
+
+
+class DistillTrainNet(nn.Cell):
+    """
+    training forward and losses of ModelSRSCRSG as a cell, the loss_net of TrainStep
+        netG: trained network
+        net_rsg: frozen PWC teacher
+        losses: loss cells of G_lossfn_type, built before the first step
+        losses_name, ratios: their names and weights
+        diff_patch: border cropped from the input patch
+    construct(L, dis_encodings, time_rsc, E_ori[, H_flows]) -> (G_loss, loss terms)
+    """
+
+    def __init__(self, netG, net_rsg, losses, losses_name, ratios, diff_patch):
+        super(DistillTrainNet, self).__init__(auto_prefix=False)  # keep the parameter names of netG
+        self.netG = netG
+        self.net_rsg = net_rsg
+        self.losses = nn.CellList(losses)
+        self.kinds = tuple(loss_kind(name) for name in losses_name)
+        self.ratios = tuple(ratios)
+        self.diff_patch = diff_patch
+
+    def forward(self, L, dis_encodings, time_rsc, E_ori):
+        """
+        training forward as a function of the batch only
+        E_ori: teacher outputs of the batch, see ModelSRSCRSG.teacher_outputs
+        returns E_crop_bound, flows, E_ori, L_t2b, L_b2t, L_t2b_mid, L_b2t_mid
+        """
+        d = self.diff_patch // 2
+        b, n, c, h, w = time_rsc.shape  # (8, 2*ext_frames, 1, 256, 256)
+        time_rsc = time_rsc.reshape(b, n * c, h, w)
+        E_crop_bound, flows = self.netG(L[:, :, :, d:-d, d:-d], time_rsc[:, :, d:-d, d:-d])   #b, num_frames*3, h, w   -----   b, num_frames*2*2, h, w
+        b, c, h, w = E_crop_bound.shape
+        assert c // 3 == 3, c
+        E = E_crop_bound.reshape(b, c // 3, 3, h, w)
+
+        dis_encodings1, dis_encodings2 = O.chunk(dis_encodings, chunks=2, axis=1)  #b,   whether reverse
+        time_coding1 = dis_encodings1[:, 1, 0]
+        time_coding2 = dis_encodings2[:, 1, 0]
+        mid_time_coding1_up, mid_time_coding1_down = dis_encodings1[:, 0, 0], dis_encodings1[:, 0, 1]
+        mid_time_coding2_up, mid_time_coding2_down = dis_encodings2[:, 0, 0], dis_encodings2[:, 0, 1]
+        mid_mask1 = dis_encodings1[:, 0, 2]   #t2b
+        mid_mask2 = dis_encodings2[:, 0, 2]   #b2t
+
+        # each frame's pyramid is extracted once, the 6 pairs are decoded as one batch
+        E0, E1, E2 = E[:, 0], E[:, 1], E[:, 2]
+        flow02, flow20, flow01, flow10, flow12, flow21 = self.net_rsg.estimate_flows(
+            [E0, E1, E2], [(0, 2), (2, 0), (0, 1), (1, 0), (1, 2), (2, 1)])
+
+        # whole (t2b, b2t), 0-1 and 1-2 (t2b, b2t), all in one batch
+        L_t2b, L_b2t, f_t2b, b_t2b, f_b2t, b_b2t = CFR_blend_batch(
+            'cuda',
+            [E0, E0, E0, E1, E0, E1],
+            [E2, E2, E1, E2, E1, E2],
+            [flow02, flow02, flow01, flow12, flow01, flow12],
+            [flow20, flow20, flow10, flow21, flow10, flow21],
+            [time_coding1, time_coding2, mid_time_coding1_up, mid_time_coding1_down, mid_time_coding2_up, mid_time_coding2_down])
+        L_t2b_mid = f_t2b * mid_mask1 + b_t2b * (1 - mid_mask1)
+        L_b2t_mid = f_b2t * mid_mask2 + b_b2t * (1 - mid_mask2)
+        return E_crop_bound, flows, E_ori, L_t2b, L_b2t, L_t2b_mid, L_b2t_mid
+
+    def G_losses(self, L, outputs, H_flows=None):
+        """weighted loss terms in the order of losses"""
+        d = self.diff_patch // 2
+        E_crop_bound, flows, E_ori, L_t2b, L_b2t, L_t2b_mid, L_b2t_mid = outputs
+        fb, fc, fh, fw = flows[0].shape
+        assert fc == 12, fc
+        L_t2b_ref, L_b2t_ref = L[:, 0, :, d:-d, d:-d], L[:, 1, :, d:-d, d:-d]
+        terms = []
+        for i in range(len(self.kinds)):
+            if self.kinds[i] == 'epe':
+                loss_sub = self.losses[i](flows[0], H_flows, 1)
+                for flow in flows[1:]:
+                    loss_sub += self.losses[i](flow, H_flows, 1)
+                loss_sub = self.ratios[i] * loss_sub.mean()
+            elif self.kinds[i] == 'variation':
+                loss_sub = self.losses[i](flows[0].reshape(fb * int(fc // 2), 2, fh, fw), mean=True)
+                for flow in flows[1:]:
+                    loss_sub += self.losses[i](flow.reshape(fb * int(fc // 2), 2, fh, fw), mean=True)
+                #for flow in self.rs_flow:
+                    #loss_sub += self.losses[i](flow, mean=True)
+                loss_sub = self.ratios[i] * loss_sub
+            elif self.kinds[i] == 'perceptual':
+                # the 5 reconstruction terms and their 3 distinct targets in one VGG forward
+                loss_sub = self.ratios[i] * self.losses[i].multi([L_t2b, L_t2b_mid, L_b2t, L_b2t_mid, E_crop_bound],
+                                                                 [L_t2b_ref, L_b2t_ref, E_ori], [0, 0, 1, 1, 2])
+            # elif self.losses_name[i].lower().startswith('Charbonnier'):
+            #     loss_sub = self.ratios[i] * (self.losses[i](self.L_t2b, self.L[:, 0]) + self.losses[i](self.L_b2t, self.L[:, 1]))  #self.ratios[i] * (self.losses[i](self.E, self.L) +
+            else:
+                loss_sub = self.ratios[i] * (self.losses[i](L_t2b, L_t2b_ref) + self.losses[i](L_t2b_mid, L_t2b_ref) + self.losses[i](L_b2t, L_b2t_ref) + self.losses[i](L_b2t_mid, L_b2t_ref))
+                loss_sub = loss_sub + self.ratios[i] * self.losses[i](E_crop_bound, E_ori)
+            terms.append(loss_sub)
+        return tuple(terms)
+
+    def construct(self, L, dis_encodings, time_rsc, E_ori, H_flows=None):
+        """loss of one batch and its terms, the function TrainStep differentiates and compiles"""
+        terms = self.G_losses(L, self.forward(L, dis_encodings, time_rsc, E_ori), H_flows)
+        G_loss = terms[0]
+        for loss_sub in terms[1:]:
+            G_loss = G_loss + loss_sub
+        return G_loss, terms
+
+
 class ModelSRSCRSG(ModelPlain):
     """Train with pixel loss"""
     def __init__(self, opt):
@@ -32,9 +148,16 @@ class ModelSRSCRSG(ModelPlain):
         self.fix_iter = self.opt_train.get('fix_iter', 0)
         self.fix_keys = self.opt_train.get('fix_keys', [])
         self.fix_unflagged = True
-        self.net_rsg = net(load_pretrain=True, pretrain_fn=self.opt['path']['pretrained_rsg'])
+        self.net_rsg = net(load_pretrain=True, pretrain_fn=self.opt['path']['pretrained_rsg'],
+                           scale=self.opt_train.get('teacher_scale', 1.0),  # teacher working resolution
+                           output_level=self.opt_train.get('teacher_output_level', None),  # teacher stopping level
+                           precision=self.opt_train.get('teacher_precision', 'fp32'))  # fp32 | fp16 | int8
         self.net_rsg = self.model_to_device(self.net_rsg)
         self.ext_frames = self.opt['datasets']['test']['frames']
+        self.single_pass = self.opt['datasets']['test'].get('single_pass', True)  # all time codes in one netG pass
+        self.tile_size = self.opt['datasets']['test'].get('tile_size', None)  # tiled inference, None for whole frames
+        self.tile_overlap = self.opt['datasets']['test'].get('tile_overlap', 32)
+        self.tile_batch = self.opt['datasets']['test'].get('tile_batch', 1)
         print("The number of extracting frames:", self.ext_frames)
 
     """
@@ -54,6 +177,17 @@ class ModelSRSCRSG(ModelPlain):
         self.define_optimizer()               # define optimizer
         self.load_optimizers()                # load optimizer
         self.define_scheduler()               # define scheduler
+        self.define_teacher_cache()           # define cache of frozen teacher outputs
+        self.define_train_step()              # define compiled training step
+        self.log_dict = OrderedDict()         # log
+
+    # ----------------------------------------
+    # initialize inference only
+    # no loss, optimizer, scheduler, teacher cache or training step
+    # ----------------------------------------
+    def init_test(self):
+        self.load()                           # load model
+        self.netG.set_train(False)            # set evaluation mode
         self.log_dict = OrderedDict()         # log
 
     # ----------------------------------------
@@ -206,7 +340,9 @@ class ModelSRSCRSG(ModelPlain):
         # self.L = data['L'].to(self.device)
         # if need_H:
         #     self.H = data['H'].to(self.device)
-        self.L, self.H, self.H_flows, self.dis_encodings, self.time_rsc, self.all_time_rsc, self.out_path, self.input_path = data   #rs_imgs, gs_imgs, fl_imgs, prior_imgs, time_rsc, out_paths, input_path
+        data = list(data)
+        self.H_flows = data.pop(2) if len(data) == 9 else None  # fl_imgs is only in the columns with flow supervision
+        self.L, self.H, self.dis_encodings, self.time_rsc, self.all_time_rsc, self.crop_info, self.out_path, self.input_path = data   #rs_imgs, gs_imgs, prior_imgs, time_rsc, all_time_rsc, crop_info, out_paths, input_path
         #self.L = self.L.to(self.device)
         #self.H = self.H.to(self.device)
         # self.H_flows = self.H_flows.to(self.device)
@@ -255,124 +391,112 @@ class ModelSRSCRSG(ModelPlain):
             x: [B, C, H, W] (im2)
             flo: [B, 2, H, W] flow
         """
-        B, C, H, W = x.shape
-        # mesh grid
-        xx = O.arange(0, W).view(1, -1).tile((H, 1))
-        yy = O.arange(0, H).view(-1, 1).tile((1, W))
-        xx = xx.view(1, 1, H, W).tile((B, 1, 1, 1))
-        yy = yy.view(1, 1, H, W).tile((B, 1, 1, 1))
-        grid = O.cat((xx, yy), 1).float()
-        #grid = grid.to(self.device)
-        vgrid = grid + flo
-
-        # scale grid to [-1,1]
-        vgrid[:, 0, :, :] = 2.0 * vgrid[:, 0, :, :].copy() / max(W - 1, 1) - 1.0
-        vgrid[:, 1, :, :] = 2.0 * vgrid[:, 1, :, :].copy() / max(H - 1, 1) - 1.0
-
-        vgrid = vgrid.permute(0, 2, 3, 1)
-        output = O.grid_sample(x, vgrid, padding_mode='border')
-        mask = O.ones(x.shape)
-        mask = O.grid_sample(mask, vgrid)
-
-        mask[mask < 0.999] = 0
-        mask[mask > 0] = 1
-
-        output = output * mask
-
+        output, _ = masked_warp(x, flo)
         return output
 
+    def netG_run(self, L, time_rsc):
+        """test-time netG call, whole frame or tiled"""
+        if self.tile_size:
+            return test_tile(self.netG, L, time_rsc, tile=self.tile_size, overlap=self.tile_overlap,
+                             tile_batch=self.tile_batch, pad_mode='circular')
+        E, self.flows = self.netG(L, time_rsc)
+        return E
+
+    def netG_forward_multi(self):
+        """
+        all intermediate time codes in a single netG pass, sharing the time-independent work
+        returns E: b, ext_frames, 3, h, w
+        """
+        b, n, c, h, w = self.time_rsc.shape  # (b, 6, 1, h, w)  t2b: 0, index, 8;  b2t: 0, index, 8
+        num_mid = self.ext_frames - 2
+        start_end = self.time_rsc.reshape(b, 1, n * c, h, w).broadcast_to((b, num_mid, n * c, h, w))
+        mid_t2b = self.all_time_rsc[:, 1:self.ext_frames-1].reshape(b, num_mid, 1, h, w)
+        mid_b2t = self.all_time_rsc[:, self.ext_frames+1:2*self.ext_frames-1].reshape(b, num_mid, 1, h, w)
+        time_rsc = O.cat((start_end[:, :, 0:1], mid_t2b, start_end[:, :, 2:4], mid_b2t, start_end[:, :, 5:6]), axis=2)
+        time_start = time.time()
+        E = self.netG_run(self.L, time_rsc)  # b, ext_frames-2, num_frames*3, h, w
+        time_end = time.time()
+        print("Inference time:", time_end - time_start)
+        E = E.reshape(b, num_mid, E.shape[2] // 3, 3, h, w)
+        assert E.shape[2] == 3, E.shape[2]
+        # start from the first time code, end from the last one, one middle frame from each
+        return O.cat((E[:, 0, 0:1], E[:, :, 1], E[:, -1, 2:3]), axis=1)
+
+    def netG_forward_loop(self):
+        """one netG pass per intermediate time code, returns E: b, ext_frames, 3, h, w"""
+        E_list = []
+        avg_time = 0
+        for idx in range(1, self.ext_frames-1):  #(1,8)   #self.time_rsc  b,6(t2b:0,index,8; b2t:0,index,8),1,h,w
+            self.time_rsc[:, 1] = self.all_time_rsc[:, idx]
+            self.time_rsc[:, 4] = self.all_time_rsc[:, idx+self.ext_frames]  #+9
+            b, n, c, h, w = self.time_rsc.shape  # (8, 2*ext_frames, 1, 256, 256)
+            time_rsc = self.time_rsc.reshape(b, n * c, h, w)
+            #torch.cuda.synchronize()
+            time_start = time.time()
+            E = self.netG_run(self.L, time_rsc)  # b, num_frames*3, h, w
+            #torch.cuda.synchronize()
+            time_end = time.time()
+            diff_time = time_end - time_start
+            avg_time = avg_time + diff_time
+            b, c, h, w = E.shape
+            E = E.reshape(b, c // 3, 3, h, w)
+            assert c // 3 == 3, c
+            if idx == 1:
+                E_list.append(E[:, 0])
+                E_list.append(E[:, 1])
+            elif idx == self.ext_frames-2:   # 7
+                E_list.append(E[:, 1])
+                E_list.append(E[:, 2])
+            else:
+                E_list.append(E[:, 1])
+        assert len(E_list) == self.ext_frames, len(E_list)    #9
+        avg_time = avg_time / (self.ext_frames-2)
+        print("Average inference time:", avg_time)
+        return O.stack(E_list, axis=1)
+
+    def teacher_forward(self, L, time_rsc):
+        """boundary consistency target of netE on the uncropped patch, no gradient flows into it"""
+        d = self.diff_patch // 2
+        b, n, c, h, w = time_rsc.shape
+        E_ori, _ = self.netE(L, time_rsc.reshape(b, n * c, h, w))
+        return O.stop_gradient(E_ori[:, :, d:-d, d:-d])
+
+    def teacher_outputs(self):
+        """netE outputs of the current batch, read from / written to the teacher cache if there is one"""
+        if self.teacher_cache is None:
+            return self.teacher_forward(self.L, self.time_rsc)
+        paths = self.out_path.asnumpy() if hasattr(self.out_path, 'asnumpy') else np.asarray(self.out_path)
+        crop_info = self.crop_info.asnumpy() if hasattr(self.crop_info, 'asnumpy') else np.asarray(self.crop_info)
+        h, w = self.L.shape[-2:]
+        keys = [(str(path[0]), int(top), int(left), int(index), h, w) for path, (top, left, index) in zip(paths, crop_info)]
+        E_ori = self.teacher_cache.get_batch(keys)
+        if E_ori is not None:
+            return ms.Tensor(E_ori)
+        E_ori = self.teacher_forward(self.L, self.time_rsc)
+        self.teacher_cache.put_batch(keys, E_ori.asnumpy())
+        return E_ori
+
     def netG_forward(self, is_train=True):
 
         b, n, c, h, w = self.L.shape  # (8, 3, 3, 256, 256)
         ori_h, ori_w = h, w
 
-        if not is_train:
+        if not is_train and not self.tile_size:
             self.L = self.pad(self.L)
             self.dis_encodings = self.pad(self.dis_encodings)
             self.time_rsc = self.pad(self.time_rsc)
             self.all_time_rsc = self.pad(self.all_time_rsc)
         if is_train:
-            b, n, c, h, w = self.time_rsc.shape  # (8, 2*ext_frames, 1, 256, 256)
-            time_rsc = self.time_rsc.reshape(b, n * c, h, w)
-            self.E, self.flows = self.netG(self.L[:, :, :, self.diff_patch//2:-self.diff_patch//2, self.diff_patch//2:-self.diff_patch//2], time_rsc[:, :, self.diff_patch//2:-self.diff_patch//2, self.diff_patch//2:-self.diff_patch//2])   #b, num_frames*3, h, w   -----   b, num_frames*2*2, h, w
-            self.E_crop_bound = self.E
-            b, c, h, w = self.E.shape
-            self.E = self.E.reshape(b, c // 3, 3, h, w)
-            assert c // 3 == 3, c
-            # boundary consistancy
-            # with torch.no_grad()
-            self.E_ori, _ = self.netE(self.L, time_rsc)
-            self.E_ori = self.E_ori[:, :, self.diff_patch//2:-self.diff_patch//2, self.diff_patch//2:-self.diff_patch//2]
+            outputs = self.train_net.forward(self.L, self.dis_encodings, self.time_rsc, self.teacher_outputs())
+            self.E_crop_bound, self.flows, self.E_ori, self.L_t2b, self.L_b2t, self.L_t2b_mid, self.L_b2t_mid = outputs
+            b, c, h, w = self.E_crop_bound.shape
+            self.E = self.E_crop_bound.reshape(b, c // 3, 3, h, w)
         else:
             assert self.all_time_rsc.shape[1]//2 == self.ext_frames, self.all_time_rsc.shape[1]   #9
-            E_list = []
-            avg_time = 0
-            for idx in range(1, self.ext_frames-1):  #(1,8)   #self.time_rsc  b,6(t2b:0,index,8; b2t:0,index,8),1,h,w
-                self.time_rsc[:, 1] = self.all_time_rsc[:, idx]
-                self.time_rsc[:, 4] = self.all_time_rsc[:, idx+self.ext_frames]  #+9
-                b, n, c, h, w = self.time_rsc.shape  # (8, 2*ext_frames, 1, 256, 256)
-                time_rsc = self.time_rsc.reshape(b, n * c, h, w)
-                #torch.cuda.synchronize()
-                time_start = time.time()
-                self.E, self.flows = self.netG(self.L, time_rsc)  # b, num_frames*3, h, w   -----   b, num_frames*2*2, h, w
-                #torch.cuda.synchronize()
-                time_end = time.time()
-                diff_time = time_end - time_start
-                avg_time = avg_time + diff_time
-                b, c, h, w = self.E.shape
-                self.E = self.E.reshape(b, c // 3, 3, h, w)
-                assert c // 3 == 3, c
-                if idx == 1:
-                    E_list.append(self.E[:, 0])
-                    E_list.append(self.E[:, 1])
-                elif idx == self.ext_frames-2:   # 7
-                    E_list.append(self.E[:, 1])
-                    E_list.append(self.E[:, 2])
-                else:
-                    E_list.append(self.E[:, 1])
-            assert len(E_list) == self.ext_frames, len(E_list)    #9
-            self.E = O.stack(E_list, axis=1)
-            avg_time = avg_time / (self.ext_frames-2)
-            print("Average inference time:", avg_time)
-
-        if is_train:
-            self.dis_encodings1, self.dis_encodings2 = O.chunk(self.dis_encodings, chunks=2, axis=1)  #b,   whether reverse
-            time_coding1 = self.dis_encodings1[:, 1, 0]
-            time_coding2 = self.dis_encodings2[:, 1, 0]
-            mid_time_coding1_up, mid_time_coding1_down = self.dis_encodings1[:, 0, 0], self.dis_encodings1[:, 0, 1]
-            mid_time_coding2_up, mid_time_coding2_down = self.dis_encodings2[:, 0, 0], self.dis_encodings2[:, 0, 1]
-            mid_mask1 = self.dis_encodings1[:, 0, 2]   #t2b
-            mid_mask2 = self.dis_encodings2[:, 0, 2]   #b2t
-
-            self.flow02 = self.net_rsg(self.E[:, 0], self.E[:, 2])
-            self.flow20 = self.net_rsg(self.E[:, 2], self.E[:, 0])
-            self.flow01 = self.net_rsg(self.E[:, 0], self.E[:, 1])
-            self.flow10 = self.net_rsg(self.E[:, 1], self.E[:, 0])
-            self.flow12 = self.net_rsg(self.E[:, 1], self.E[:, 2])
-            self.flow21 = self.net_rsg(self.E[:, 2], self.E[:, 1])
-
-            # whole
-            ft0, ft2 = CFR_flow_t_align('cuda', self.flow02, self.flow20, time_coding1)
-            self.L_t2b = (1 - time_coding1) * self.warp(self.E[:, 0], ft0) + time_coding1 * self.warp(self.E[:, 2], ft2)  #* occ_0   * occ_1
-            ft0, ft2 = CFR_flow_t_align('cuda', self.flow02, self.flow20, time_coding2)
-            self.L_b2t = (1 - time_coding2) * self.warp(self.E[:, 0], ft0) + time_coding2 * self.warp(self.E[:, 2], ft2)  #* occ_0   * occ_1
-
-            # 0-1, 1-2
-            ft0_f, ft1_f = CFR_flow_t_align('cuda', self.flow01, self.flow10, mid_time_coding1_up)
-            warped_img_f = (1 - mid_time_coding1_up) * self.warp(self.E[:, 0], ft0_f) + mid_time_coding1_up * self.warp(self.E[:, 1], ft1_f)
-            warped_img_f = warped_img_f * mid_mask1
-            ft1_b, ft2_b = CFR_flow_t_align('cuda', self.flow12, self.flow21, mid_time_coding1_down)
-            warped_img_b = (1 - mid_time_coding1_down) * self.warp(self.E[:, 1], ft1_b) + mid_time_coding1_down * self.warp(self.E[:, 2], ft2_b)
-            warped_img_b = warped_img_b * (1 - mid_mask1)
-            self.L_t2b_mid = warped_img_b + warped_img_f
-
-            ft0_f, ft1_f = CFR_flow_t_align('cuda', self.flow01, self.flow10, mid_time_coding2_up)
-            warped_img_f = (1 - mid_time_coding2_up) * self.warp(self.E[:, 0], ft0_f) + mid_time_coding2_up * self.warp(self.E[:, 1], ft1_f)
-            warped_img_f = warped_img_f * mid_mask2
-            ft1_b, ft2_b = CFR_flow_t_align('cuda', self.flow12, self.flow21, mid_time_coding2_down)
-            warped_img_b = (1 - mid_time_coding2_down) * self.warp(self.E[:, 1], ft1_b) + mid_time_coding2_down * self.warp(self.E[:, 2], ft2_b)
-            warped_img_b = warped_img_b * (1 - mid_mask2)
-            self.L_b2t_mid = warped_img_b + warped_img_f
+            if self.single_pass:
+                self.E = self.netG_forward_multi()
+            else:
+                self.E = self.netG_forward_loop()
 
         if ori_h % 32 != 0 or ori_w % 32 != 0:
             if not is_train:
@@ -382,42 +506,44 @@ class ModelSRSCRSG(ModelPlain):
     # ----------------------------------------
     # update parameters and get loss
     # ----------------------------------------
+    def train_inputs(self):
+        """inputs of train_net for the current batch, the teacher runs outside of the differentiated step"""
+        inputs = (self.L, self.dis_encodings, self.time_rsc, self.teacher_outputs())
+        return inputs + ((self.H_flows,) if self.H_flows is not None else ())
+
+    def define_teacher_cache(self):
+        """disk cache of netE outputs, only for a frozen teacher (E_decay == 1) and crops on a grid (crop_grid > 1)"""
+        self.teacher_cache = None
+        cache_dir = self.opt_train['teacher_cache_dir']
+        if not cache_dir:
+            return
+        if self.opt_train['E_decay'] != 1:
+            print('Teacher cache disabled, netE is updated with E_decay={}.'.format(self.opt_train['E_decay']))
+            return
+        crop_grid = self.opt['datasets']['train']['crop_grid'] or 1
+        if crop_grid <= 1:
+            # every crop offset is drawn anew, keys would almost never repeat
+            print('Teacher cache disabled, it needs datasets.train.crop_grid > 1 (got {}).'.format(crop_grid))
+            return
+        max_gb = self.opt_train.get('teacher_cache_max_gb', 16)
+        self.teacher_cache = TeacherCache(cache_dir, fingerprint(self.netE),
+                                          max_bytes=int(max_gb * (1 << 30)) if max_gb else None)
+        print('Teacher outputs cached in [{:s}], namespace {:s}'.format(cache_dir, self.teacher_cache.namespace))
+
+    def define_train_step(self):
+        """
+        forward, loss, grads and optimizer update built once, compiled with ms.jit unless jit_train_step is false
+        rebuild it after replacing netG, net_rsg or the losses
+        """
+        if self.opt_train['compile_cache_dir']:
+            enable_compile_cache(self.opt_train['compile_cache_dir'])
+        self.train_net = DistillTrainNet(self.netG, self.net_rsg, self.losses, self.losses_name, self.ratios, self.diff_patch)
+        self.train_step = TrainStep(self.train_net, self.G_optimizer, jit=self.opt_train.get('jit_train_step', True))
+
     def optimize_parameters(self, current_step):
-        def forward_fn():
-          self.netG_forward()
-          fb, fc, fh, fw = self.flows[0].shape
-          assert fc == 12, fc
-          losses = {}
-          loss_all = None
-          for i in range(len(self.losses)):
-              if self.losses_name[i].lower().startswith('epe'):
-                  loss_sub = self.losses[i](self.flows[0], self.H_flows, 1)
-                  for flow in self.flows[1:]:
-                      loss_sub += self.losses[i](flow, self.H_flows, 1)
-                  loss_sub = self.ratios[i] * loss_sub.mean()
-              elif self.losses_name[i].lower().startswith('variation'):
-                  loss_sub = self.losses[i](self.flows[0].reshape(fb * int(fc // 2), 2, fh, fw), mean=True)
-                  for flow in self.flows[1:]:
-                      loss_sub += self.losses[i](flow.reshape(fb * int(fc // 2), 2, fh, fw), mean=True)
-                  #for flow in self.rs_flow:
-                      #loss_sub += self.losses[i](flow, mean=True)
-                  loss_sub = self.ratios[i] * loss_sub
-              # elif self.losses_name[i].lower().startswith('Charbonnier'):
-              #     loss_sub = self.ratios[i] * (self.losses[i](self.L_t2b, self.L[:, 0]) + self.losses[i](self.L_b2t, self.L[:, 1]))  #self.ratios[i] * (self.losses[i](self.E, self.L) +
-              else:
-                  loss_sub = self.ratios[i] * (self.losses[i](self.L_t2b, self.L[:, 0, :, self.diff_patch//2:-self.diff_patch//2, self.diff_patch//2:-self.diff_patch//2]) + self.losses[i](self.L_t2b_mid, self.L[:, 0, :, self.diff_patch//2:-self.diff_patch//2, self.diff_patch//2:-self.diff_patch//2]) + self.losses[i](self.L_b2t, self.L[:, 1, :, self.diff_patch//2:-self.diff_patch//2, self.diff_patch//2:-self.diff_patch//2]) + self.losses[i](self.L_b2t_mid, self.L[:, 1, :, self.diff_patch//2:-self.diff_patch//2, self.diff_patch//2:-self.diff_patch//2]))
-                  loss_sub = loss_sub + self.ratios[i] * self.losses[i](self.E_crop_bound, self.E_ori)
-              losses[self.losses_name[i]] = loss_sub
-              self.log_dict[self.losses_name[i]] = loss_sub.item()
-              if loss_all == None:
-                  loss_all = loss_sub
-              else:
-                  loss_all += loss_sub
-          G_loss = loss_all
-          return G_loss
-        grad_fn = ms.value_and_grad(forward_fn, None, self.G_optimizer.parameters)
-        grads=grad_fn()
-        #G_loss.backward()
+        G_loss, terms = self.train_step(*self.train_inputs())
+        for name, loss_sub in zip(self.losses_name, terms):
+            self.log_dict[name] = loss_sub.item()
 
         # ------------------------------------
         # clip_grad
@@ -427,8 +553,7 @@ class ModelSRSCRSG(ModelPlain):
         #G_optimizer_clipgrad = self.opt_train['G_optimizer_clipgrad'] if self.opt_train['G_optimizer_clipgrad'] else 0
         #if G_optimizer_clipgrad > 0:
         #    torch.nn.utils.clip_grad_norm_(self.netG.parameters(), max_norm=self.opt_train['G_optimizer_clipgrad'], norm_type=2)
-        
-        self.G_optimizer(grads)
+        # the optimizer update runs inside self.train_step
         #self.G_optimizer.step()
 
         # ------------------------------------
@@ -444,8 +569,10 @@ class ModelSRSCRSG(ModelPlain):
         # self.log_dict['G_loss'] = G_loss.item()/self.E.shape[0]  # if `reduction='sum'`
         self.log_dict['G_loss'] = G_loss.item()
 
-        if self.opt_train['E_decay'] > 0:
-            self.update_E(self.opt_train['E_decay'])
+        # E_decay 1 is a frozen teacher, nothing to update; every k steps the decay of k steps is applied at once
+        E_decay, E_every = self.opt_train['E_decay'], self.opt_train['E_update_every'] or 1
+        if 0 < E_decay < 1 and current_step % E_every == 0:
+            self.update_E(E_decay ** E_every)
 
     # ----------------------------------------
     # test / inference
@@ -456,6 +583,28 @@ class ModelSRSCRSG(ModelPlain):
         self.netG_forward(False)
         self.netG.set_train(True)
 
+    # ----------------------------------------
+    # test / inference at given scan-times
+    # ----------------------------------------
+    def test_times(self, L, times):
+        """
+        GS frames of dual RS images at arbitrary scan-times, whole frame or tiled
+            L: b, 2, 3, h, w
+            times: scan-times in [0, 1]
+        returns: b, len(times), 3, h, w
+        """
+        b, n, c, h, w = L.shape
+        mids = [t for t in times if 0 < t < 1]
+        assert len(mids) > 0, times  # as in construct_times, for both paths
+        self.netG.set_train(False)
+        if self.tile_size:
+            encoding = time_encoding(mids, h, w).broadcast_to((b, len(mids), 6, h, w))
+            E = time_frames(self.netG_run(L, encoding), times)
+        else:
+            E = self.netG.construct_times(self.pad(L), times, full_h=h)[..., :h, :w]
+        self.netG.set_train(True)
+        return E
+
     # ----------------------------------------
     # test / inference x8
     # ----------------------------------------
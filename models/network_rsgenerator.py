@@ -1,7 +1,7 @@
 import mindspore as ms
 import mindspore.nn as nn
 import mindspore.ops as O
-from .warplayer import multi_warp
+from .warplayer import multi_warp, masked_warp
 
 from models import flow_pwc
 
@@ -23,12 +23,30 @@ def CFR_flow_t_align(device, flow_01, flow_10, t_value):
 
     return flow_t0, flow_t1
 
+def CFR_blend_batch(device, imgs_0, imgs_1, flows_01, flows_10, t_values):
+    """
+    several CFR interpolations in one batched flow alignment and one batched warp
+        imgs_0, imgs_1: lists of K end frames (B, C, H, W)
+        flows_01, flows_10: lists of K flow pairs between them (B, 2, H, W)
+        t_values: list of K time codes (B, 1, H, W)
+    returns: list of K frames (1 - t) * warp(img_0, f_t0) + t * warp(img_1, f_t1)
+    """
+    K = len(t_values)
+    t_value = O.cat(t_values, axis=0)
+    flow_t0, flow_t1 = CFR_flow_t_align(device, O.cat(flows_01, axis=0), O.cat(flows_10, axis=0), t_value)
+    warped, _ = masked_warp(O.cat(imgs_0 + imgs_1, axis=0), O.cat([flow_t0, flow_t1], axis=0))
+    warped_0, warped_1 = O.chunk(warped, 2, axis=0)
+    return O.chunk((1 - t_value) * warped_0 + t_value * warped_1, K, axis=0)
+
 def fwarp(device, img, flo):
     """
         -img: image (N, C, H, W)
         -flo: optical flow (N, 2, H, W)
         elements of flo is in [0, H] and [0, W] for dx, dy
+    returns the splatted image (N, C, H, W) and the splatted weights (N, 1, H, W)
 
+    the four corners share their weights across channels, so indices and weights are computed once
+    per pixel and all corners and channels (plus the weight itself) are accumulated in one segment sum
     """
 
     # (x1, y1)		(x1, y2)
@@ -42,14 +60,11 @@ def fwarp(device, img, flo):
     # +---------------+
     # (x2, y1)		(x2, y2)
 
-    N, C, _, _ = img.shape
+    N, C, H, W = img.shape
 
     # translate start-point optical flow to end-point optical flow
-    y = flo[:, 0:1:, :]
-    x = flo[:, 1:2, :, :]
-
-    x = x.tile((1, C, 1, 1))
-    y = y.tile((1, C, 1, 1))
+    y = flo[:, 0]
+    x = flo[:, 1]
 
     # Four point of square (x1, y1), (x1, y2), (x2, y1), (y2, y2)
     x1 = O.floor(x)
@@ -60,16 +75,25 @@ def fwarp(device, img, flo):
     # firstly, get gaussian weights
     w11, w12, w21, w22 = get_gaussian_weights(x, y, x1, x2, y1, y2)
 
-    # secondly, sample each weighted corner
-    img11, o11 = sample_one(device, img, x1, y1, w11)
-    img12, o12 = sample_one(device, img, x1, y2, w12)
-    img21, o21 = sample_one(device, img, x2, y1, w21)
-    img22, o22 = sample_one(device, img, x2, y2, w22)
-
-    imgw = img11 + img12 + img21 + img22
-    o = o11 + o12 + o21 + o22
-
-    return imgw, o
+    # secondly, target pixel of each corner, out of bounds go to a dummy segment N*H*W
+    basex = O.arange(0, H).view(1, H, 1)
+    basey = O.arange(0, W).view(1, 1, W)
+    idxn = O.arange(0, N).view(N, 1, 1) * (H * W)
+    ids = []
+    for cx, cy in [(x1, y1), (x1, y2), (x2, y1), (x2, y2)]:
+        idxx = cx.astype(ms.int32) + basex
+        idxy = cy.astype(ms.int32) + basey
+        mask = (idxx >= 0) & (idxx < H) & (idxy >= 0) & (idxy < W)
+        ids.append(O.where(mask, idxn + idxx * W + idxy, N * H * W))
+    ids = O.stack(ids, axis=0).view(-1)  # 4*N*H*W
+
+    # weighted channels and the weight itself, (4, N, H, W, C+1)
+    weight = O.stack([w11, w12, w21, w22], axis=0).unsqueeze(-1)
+    values = O.cat([img.permute(0, 2, 3, 1).unsqueeze(0) * weight, weight], axis=-1)
+    splat = O.unsorted_segment_sum(values.view(-1, C + 1), ids, N * H * W + 1)[:N * H * W]
+    splat = splat.view(N, H, W, C + 1).permute(0, 3, 1, 2)
+
+    return splat[:, :C], splat[:, C:]
 
 def get_gaussian_weights(x, y, x1, x2, y1, y2):
     w11 = O.exp(-((x - x1) ** 2 + (y - y1) ** 2))
@@ -80,54 +104,6 @@ def get_gaussian_weights(x, y, x1, x2, y1, y2):
     return w11, w12, w21, w22
 
 
-def sample_one(device, img, shiftx, shifty, weight):
-    """
-    Input:
-        -img (N, C, H, W)
-        -shiftx, shifty (N, c, H, W)
-    """
-
-    N, C, H, W = img.shape
-
-    # flatten all (all restored as Tensors)
-    flat_shiftx = shiftx.view(-1)
-    flat_shifty = shifty.view(-1)
-    flat_basex = O.arange(0, H).view(-1, 1)[None, None].long().tile((N, C,
-                                                                                                          1,
-                                                                                                          W)).view(
-        -1)
-    flat_basey = O.arange(0, W).view(1, -1)[None, None].long().tile((N, C,
-                                                                                                          H,
-                                                                                                          1)).view(
-        -1)
-    flat_weight = weight.view(-1)
-    flat_img = img.contiguous().view(-1)
-
-    # The corresponding positions in I1
-    idxn = O.arange(0, N).view(N, 1, 1, 1).long().tile((1, C, H, W)).view(
-        -1)
-    idxc = O.arange(0, C).view(1, C, 1, 1).long().tile((N, 1, H, W)).view(
-        -1)
-    # ttype = flat_basex.type()
-    idxx = flat_shiftx.long() + flat_basex
-    idxy = flat_shifty.long() + flat_basey
-
-    # recording the inside part the shifted
-    mask = idxx.ge(0) & idxx.lt(H) & idxy.ge(0) & idxy.lt(W)
-
-    # Mask off points out of boundaries
-    ids = (idxn * C * H * W + idxc * H * W + idxx * W + idxy)
-    ids_mask = O.masked_select(ids, mask).copy()
-
-    # Note here! accmulate fla must be true for proper bp
-    img_warp = O.zeros([N * C * H * W, ])
-    img_warp.index_put([ids_mask], O.masked_select(flat_img * flat_weight, mask), accumulate=True)
-
-    one_warp = O.zeros([N * C * H * W, ])
-    one_warp.index_put([ids_mask], O.masked_select(flat_weight, mask), accumulate=True)
-
-    return img_warp.view(N, C, H, W), one_warp.view(N, C, H, W)
-
 def conv(in_planes, out_planes, kernel_size=3, stride=1, padding=1, dilation=1):
     return nn.Sequential([
         nn.Conv2d(in_planes, out_planes, kernel_size=kernel_size, stride=stride, pad_mode="pad",
@@ -249,30 +225,7 @@ class IFEDNet(nn.Cell):
             x: [B, C, H, W] (im2)
             flo: [B, 2, H, W] flow
         """
-        B, C, H, W = x.shape
-        # mesh grid
-        xx = O.arange(0, W).view(1, -1).tile((H, 1))
-        yy = O.arange(0, H).view(-1, 1).tile((1, W))
-        xx = xx.view(1, 1, H, W).tile((B, 1, 1, 1))
-        yy = yy.view(1, 1, H, W).tile((B, 1, 1, 1))
-        grid = O.cat((xx, yy), 1).float()
-        #grid = grid.to(self.device)
-        vgrid = grid + flo
-
-        # scale grid to [-1,1]
-        vgrid[:, 0, :, :] = 2.0 * vgrid[:, 0, :, :].copy() / max(W - 1, 1) - 1.0
-        vgrid[:, 1, :, :] = 2.0 * vgrid[:, 1, :, :].copy() / max(H - 1, 1) - 1.0
-
-        vgrid = vgrid.permute(0, 2, 3, 1)
-        output = O.grid_sample(x, vgrid, padding_mode='border')
-        mask = O.ones(x.shape)
-        mask = O.grid_sample(mask, vgrid)
-
-        mask[mask < 0.999] = 0
-        mask[mask > 0] = 1
-
-        output = output * mask
-
+        output, _ = masked_warp(x, flo)
         return output
 
     def construct(self, x0, x2, flow02, flow20, encoding, is_b2t):  #rs_cube channel: c,c,2c,4c,8c   rs_cube,
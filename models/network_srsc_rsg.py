@@ -25,6 +25,48 @@ def pad(img, ratio=32):
         img = O.pad(img, padding, mode='replicate')
         return img
 
+def time_encoding(times, h, w, full_h=None, top=0):
+    """
+    distortion encodings of target scan-times, the same row-linear maps as data.distortion_prior.distortion_map
+        times: n scan-times in [0, 1], 0 is the first and 1 the last scanned row
+        h, w: size of the encoded window
+        full_h: sensor height the scan-times refer to, h by default
+        top: first row of the window on the sensor
+    returns: (1, n, 6, h, w), t2b codes of (0, t, 1) followed by b2t codes of (0, t, 1)
+    """
+    n = len(times)
+    full_h = h if full_h is None else full_h
+    ref_rows = []
+    for t in times:
+        ref_rows += [0., float(t), 1.]
+    ref_rows = ms.Tensor(ref_rows, ms.float32).reshape(1, n, 3, 1, 1) * (full_h - 1)
+    rows = O.arange(top, top + h).astype(ms.float32).reshape(1, 1, 1, h, 1)
+    t2b = (rows - ref_rows) / (full_h - 1)
+    b2t = ((full_h - 1 - rows) - ref_rows) / (full_h - 1)
+    encoding = O.cat((t2b, b2t), axis=2)  # (1, n, 6, h, 1)
+    return encoding.broadcast_to((1, n, 6, h, w))
+
+def time_frames(out, times):
+    """
+    GS frame of every scan-time from the outputs of its (0, t, 1) time code
+        out: (b, n, 9, h, w) outputs for the times in (0, 1), in order
+        times: scan-times in [0, 1], times 0 and 1 are taken from the start and end frames of
+               the first and last time code, as in the test loop
+    returns: (b, len(times), 3, h, w)
+    """
+    b, n, c, h, w = out.shape
+    out = out.reshape(b, n, c // 3, 3, h, w)
+    mids = [t for t in times if 0 < t < 1]
+    frames = []
+    for t in times:
+        if t <= 0:
+            frames.append(out[:, 0, 0])
+        elif t >= 1:
+            frames.append(out[:, -1, 2])
+        else:
+            frames.append(out[:, mids.index(t), 1])
+    return O.stack(frames, axis=1)
+
 def conv(in_planes, out_planes, kernel_size=3, stride=1, padding=1, dilation=1):
     return nn.SequentialCell([
         nn.Conv2d(in_planes, out_planes, kernel_size=kernel_size, stride=stride, pad_mode="pad",
@@ -91,6 +133,33 @@ class IFBlock(nn.Cell):
             # print(flow.size())
         return flow
 
+    def construct_shared(self, x, encoding):
+        """
+        block forward for several encodings that share the same image input
+            x: (b, c_x, h, w) image part of the block input
+            encoding: (b*n, c_e, h, w) encoding part, n encodings per image
+        the image part of the first conv is computed once and repeated n times
+        """
+        n = encoding.shape[0] // x.shape[0]
+        if self.scale != 1:
+            x = O.interpolate(x, scale_factor=1. / self.scale, mode="bilinear",
+                              align_corners=False,recompute_scale_factor=True)
+            encoding = O.interpolate(encoding, scale_factor=1. / self.scale, mode="bilinear",
+                                     align_corners=False,recompute_scale_factor=True)
+
+        conv_in, act_in = self.conv0[0][0], self.conv0[0][1]
+        c_x = x.shape[1]
+        feat_x = conv_in.conv2d(x, conv_in.weight[:, :c_x])
+        feat_e = conv_in.conv2d(encoding, conv_in.weight[:, c_x:])
+        feat = conv_in.bias_add(O.repeat_interleave(feat_x, n, 0) + feat_e, conv_in.bias)
+        x = self.conv0[1](act_in(feat))
+        x = self.convblock(x)
+        flow = self.conv1(x)
+        if self.scale != 1:
+            flow = O.interpolate(flow, scale_factor=1.*self.scale, mode="bilinear",
+                                 align_corners=False,recompute_scale_factor=True)
+        return flow
+
 
 class FlowNetMulCatFusion(nn.Cell):
     def __init__(self, num_flows=3):
@@ -115,10 +184,22 @@ class FlowNetMulCatFusion(nn.Cell):
         return flows
 
     def construct(self, x, encoding, return_velocity=False):
+        flow0 = self.block0(O.cat((x, encoding), axis=1))  # h/2,w/2
+        return self._refine(x, encoding, flow0, return_velocity)
+
+    def construct_multi(self, x, encoding, return_velocity=False):
+        """
+            x: (b, 6, h, w) dual RS images
+            encoding: (b*n, 2*num_flows, h, w) n time encodings per RS pair, batch-major
+        """
+        flow0 = self.block0.construct_shared(x, encoding)  # h/2,w/2
+        x = O.repeat_interleave(x, encoding.shape[0] // x.shape[0], 0)
+        return self._refine(x, encoding, flow0, return_velocity)
+
+    def _refine(self, x, encoding, flow0, return_velocity=False):
         x_t2b, x_b2t = O.chunk(x, chunks=2, axis=1)  # (n,  3, h, w)
         encoding_ds = O.interpolate(encoding, scale_factor=0.5, mode='bilinear', align_corners=False,
                                     recompute_scale_factor=True)
-        flow0 = self.block0(O.cat((x, encoding), axis=1))  # h/2,w/2
         F1 = flow0
         F1 = self._mul_encoding(F1, encoding_ds)
         flow0 = F1
@@ -186,25 +267,32 @@ class WarpedContextNet(nn.Cell):
         self.conv4_1 = conv(num_flows * (8 * c), 8 * c, kernel_size=1, padding=0, stride=1)
 
     def construct(self, x, flow):
+        return self.fuse(self.encode(x), flow)
+
+    def encode(self, x):
+        """time-independent context features of an RS image"""
         x = self.conv0_0(x)
-        x = self.conv1_0(x)
+        x1 = self.conv1_0(x)
+        x2 = self.conv2_0(x1)
+        x3 = self.conv3_0(x2)
+        x4 = self.conv4_0(x3)
+        return [x1, x2, x3, x4]
+
+    def fuse(self, feats, flow):
         flow = O.interpolate(flow, scale_factor=0.5, mode="bilinear", align_corners=False,recompute_scale_factor=True) * 0.5
-        f1 = multi_warp(x, flow)
+        f1 = multi_warp(feats[0], flow)
         f1 = self.conv1_1(f1)
 
-        x = self.conv2_0(x)
         flow = O.interpolate(flow, scale_factor=0.5, mode="bilinear", align_corners=False,recompute_scale_factor=True) * 0.5
-        f2 = multi_warp(x, flow)
+        f2 = multi_warp(feats[1], flow)
         f2 = self.conv2_1(f2)
 
-        x = self.conv3_0(x)
         flow = O.interpolate(flow, scale_factor=0.5, mode="bilinear", align_corners=False,recompute_scale_factor=True) * 0.5
-        f3 = multi_warp(x, flow)
+        f3 = multi_warp(feats[2], flow)
         f3 = self.conv3_1(f3)
 
-        x = self.conv4_0(x)
         flow = O.interpolate(flow, scale_factor=0.5, mode="bilinear", align_corners=False,recompute_scale_factor=True) * 0.5
-        f4 = multi_warp(x, flow)
+        f4 = multi_warp(feats[3], flow)
         f4 = self.conv4_1(f4)
         return [f1, f2, f3, f4]
 
@@ -262,6 +350,12 @@ class RSG(nn.Cell):
         self.ife_net = IFEDNet(c=n_feats, num_flows=num_frames)
 
     def construct(self, x, encoding, return_velocity=False):
+        """
+            x: (b, 2, 3, h, w) dual RS images
+            encoding: (b, 2*num_frames, h, w), or (b, n, 2*num_frames, h, w) for n time encodings at once
+        """
+        if len(encoding.shape) == 5:
+            return self.construct_multi(x, encoding, return_velocity)
         x_t2b, x_b2t = x[:, 0], x[:, 1]
         x = O.cat((x_t2b, x_b2t), axis=1)
         if return_velocity:
@@ -279,6 +373,54 @@ class RSG(nn.Cell):
             return out, flows, velocity
         return out, flows
 
+    def construct_multi(self, x, encoding, return_velocity=False):
+        """
+        run several time encodings of the same RS pair in one pass
+            x: (b, 2, 3, h, w) dual RS images
+            encoding: (b, n, 2*num_frames, h, w) n time encodings per pair
+        the RS context features and the image part of the first flow block are shared over n
+        returns out: (b, n, num_frames*3, h, w), flows at batch b*n
+        """
+        b, n, c, h, w = encoding.shape
+        encoding = encoding.reshape(b * n, c, h, w)
+        x_t2b, x_b2t = x[:, 0], x[:, 1]
+        if return_velocity:
+            flow, flows, velocity = self.flow_net.construct_multi(O.cat((x_t2b, x_b2t), axis=1), encoding, return_velocity)
+        else:
+            flow, flows = self.flow_net.construct_multi(O.cat((x_t2b, x_b2t), axis=1), encoding)  ## h/2,w/2
+        flow_t2b, flow_b2t = O.chunk(flow, chunks=2, axis=1)
+        feats_t2b = [O.repeat_interleave(f, n, 0) for f in self.warped_context_net.encode(x_t2b)]
+        feats_b2t = [O.repeat_interleave(f, n, 0) for f in self.warped_context_net.encode(x_b2t)]
+        c_t2b = self.warped_context_net.fuse(feats_t2b, flow_t2b)
+        c_b2t = self.warped_context_net.fuse(feats_b2t, flow_b2t)
+        flow_t2b = O.interpolate(flow_t2b, scale_factor=2.0, mode="bilinear", align_corners=False,recompute_scale_factor=True) * 2.0  # h,w
+        flow_b2t = O.interpolate(flow_b2t, scale_factor=2.0, mode="bilinear", align_corners=False,recompute_scale_factor=True) * 2.0
+        x_t2b = O.repeat_interleave(x_t2b, n, 0)
+        x_b2t = O.repeat_interleave(x_b2t, n, 0)
+        out = self.ife_net(x_t2b, x_b2t, flow_t2b, flow_b2t, c_t2b, c_b2t)
+        out = out.reshape(b, n, out.shape[1], h, w)
+
+        if return_velocity:
+            return out, flows, velocity
+        return out, flows
+
+    def construct_times(self, x, times, full_h=None, top=0):
+        """
+        GS frames at an arbitrary list of scan-times in one batched pass
+            x: (b, 2, 3, h, w) dual RS images, h and w multiples of 32
+            times: scan-times in [0, 1], see time_encoding
+            full_h, top: unpadded sensor height and window offset of x, see time_encoding
+        each time t in (0, 1) is decoded as the middle frame of (0, t, 1), see time_frames
+        returns: (b, len(times), 3, h, w)
+        """
+        assert self.flow_net.num_flows == 3, self.flow_net.num_flows
+        b, _, _, h, w = x.shape
+        mids = [t for t in times if 0 < t < 1]
+        assert len(mids) > 0, times
+        encoding = time_encoding(mids, h, w, full_h, top).broadcast_to((b, len(mids), 6, h, w))
+        out, _ = self.construct_multi(x, encoding)
+        return time_frames(out, times)
+
 #
 # if __name__ == '__main__':
 #     from para import Parameter
@@ -18,6 +18,8 @@ import mindspore.nn as nn
 import mindspore.ops as P
 from mindspore import Tensor
 
+from models.warplayer import flow_grid
+
 
 def conv(in_planes, out_planes, kernel_size=3, stride=1, dilation=1, isReLU=True):
     if isReLU:
@@ -82,6 +84,9 @@ class FeatureExtractor(nn.Cell):
 
 
 # Warping layer ---------------------------------
+# the bilinear warp samples with the cached grids of models.warplayer,
+# the nearest warp truncates the flow to int32 (not round-to-nearest as grid_sample 'nearest'),
+# it keeps its gather on a per-call index grid and is not used by PWCNet
 def get_grid(x):
     batch_size, height, width, _ = P.Shape()(x)
     tmp1 = P.range(Tensor(0, mindspore.int32), Tensor(batch_size, mindspore.int32), Tensor(1, mindspore.int32))
@@ -108,47 +113,12 @@ def nearest_warp(x, flow):
 
 
 def bilinear_warp(x, flow):
-    _, h, w, _ = P.Shape()(x)
-    grid_b, grid_y, grid_x = get_grid(x)
-    grid_b = grid_b.astype("float32")
-    grid_y = grid_y.astype("float32")
-    grid_x = grid_x.astype("float32")
-
-    temp1 = P.Unstack(-1)(flow)
-    fx = temp1[0]
-    fy = temp1[1]
-    fx_0 = P.Floor()(fx)
-    fx_1 = fx_0 + 1
-    fy_0 = P.Floor()(fy)
-    fy_1 = fy_0 + 1
-
-    # warping indices
-    h_lim = h - 1
-    w_lim = w - 1
-
-    gy_0 = mindspore.ops.clip_by_value(grid_y + fy_0, 0.0, h_lim)
-    gy_1 = mindspore.ops.clip_by_value(grid_y + fy_1, 0.0, h_lim)
-    gx_0 = mindspore.ops.clip_by_value(grid_x + fx_0, 0.0, w_lim)
-    gx_1 = mindspore.ops.clip_by_value(grid_x + fx_1, 0.0, w_lim)
-
-    g_00 = P.Stack(3)([grid_b, gy_0, gx_0]).astype("Int32")
-    g_01 = P.Stack(3)([grid_b, gy_0, gx_1]).astype("Int32")
-    g_10 = P.Stack(3)([grid_b, gy_1, gx_0]).astype("Int32")
-    g_11 = P.Stack(3)([grid_b, gy_1, gx_1]).astype("Int32")
-
-    # gather contents
-    x_00 = P.GatherNd()(x, g_00)
-    x_01 = P.GatherNd()(x, g_01)
-    x_10 = P.GatherNd()(x, g_10)
-    x_11 = P.GatherNd()(x, g_11)
-
-    # coefficients
-    c_00 = P.ExpandDims()((fy_1 - fy) * (fx_1 - fx), 3)
-    c_01 = P.ExpandDims()((fy_1 - fy) * (fx - fx_0), 3)
-    c_10 = P.ExpandDims()((fy - fy_0) * (fx_1 - fx), 3)
-    c_11 = P.ExpandDims()((fy - fy_0) * (fx - fx_0), 3)
-
-    return c_00 * x_00 + c_01 * x_01 + c_10 * x_10 + c_11 * x_11
+    """
+    x: [B, C, H, W], flow: [B, 2, H, W] in pixels
+    border-clamped bilinear sampling, same as gathering the four clamped neighbours
+    """
+    grid = flow_grid(flow.astype(mindspore.float32))
+    return P.grid_sample(x.astype(mindspore.float32), grid, mode='bilinear', padding_mode='border', align_corners=True)
 
 
 class WarpingLayer(nn.Cell):
@@ -159,14 +129,12 @@ class WarpingLayer(nn.Cell):
         self.warp = warp_type
 
     def construct(self, x, flow):
-        x = mindspore.ops.Transpose()(x, (0, 2, 3, 1))
-        flow = mindspore.ops.Transpose()(flow, (0, 2, 3, 1))
         if self.warp == "nearest":
-            x_warped = nearest_warp(x, flow)
+            x_warped = nearest_warp(mindspore.ops.Transpose()(x, (0, 2, 3, 1)), mindspore.ops.Transpose()(flow, (0, 2, 3, 1)))
+            x_warped = mindspore.ops.Transpose()(x_warped, (0, 3, 1, 2))
         else:
             x_warped = bilinear_warp(x, flow)
-        x_warped = mindspore.ops.Transpose()(x_warped, (0, 3, 1, 2))
-        return x_warped
+        return x_warped.astype(x.dtype)  # the warp grid is float32, keep float16 features in float16
 
 
 class OpticalFlowEstimator(nn.Cell):
@@ -17,6 +17,7 @@ import mindspore
 import mindspore.nn as nn
 import mindspore.ops as P
 
+from models.correlation import correlation
 from models.pwc_modules import upsample2d_as
 from models.pwc_modules import WarpingLayer, FeatureExtractor, ContextNetwork, FlowEstimatorDense
 
@@ -31,14 +32,9 @@ class PWCNet(nn.Cell):
         self.output_level = 4
         self.num_levels = 7
         self.leakyRELU = nn.LeakyReLU(0.1)
-        self.pad = P.Pad(((0, 0), (self.search_range, self.search_range), (self.search_range, self.search_range),
-                          (0, 0)))
         self.shape = P.Shape()
-        self.reduce_mean = P.ReduceMean(keep_dims=True)
-        self.concat1 = P.Concat(3)
         self.concat2 = P.Concat(1)
         self.zeros = P.Zeros()
-        self.transpose = P.Transpose()
 
         self.feature_pyramid_extractor = FeatureExtractor(self.num_chs)
         self.warping_layer = WarpingLayer(warp_type='bilinear')
@@ -61,31 +57,34 @@ class PWCNet(nn.Cell):
         self.context_networks = ContextNetwork(self.dim_corr + 32 + 2 + 448 + 2)
 
     def cost_volume(self, x1, x2_warp):
-        padded_lvl = self.pad(x2_warp)
-        _, h, w, _ = self.shape(x1)
-        max_offset = self.search_range * 2 + 1
+        """
+        correlation of x1 with x2_warp over all (2*search_range+1)^2 displacements, NCHW in and out
+        channel y*(2*search_range+1)+x holds the displacement (y-search_range, x-search_range), averaged over C
+        """
+        return correlation(x1, x2_warp, self.search_range)
 
-        cost_vol = []
-        for y in range(0, max_offset):
-            for x in range(0, max_offset):
-                slice_ = padded_lvl[:, y : y + h, x : x + w, :]
-                cost = self.reduce_mean(x1 * slice_, 3)
-                cost_vol.append(cost)
-        cost_vol = self.concat1(cost_vol)
-        return cost_vol
+    def extract(self, x_raw):
+        """feature pyramid of a batch of frames, on the bottom level are original images"""
+        return self.feature_pyramid_extractor(x_raw) + [x_raw]
 
     def construct(self, x1_raw, x2_raw, training=False):
+        return self.decode(self.extract(x1_raw), self.extract(x2_raw), training)
 
-        # on the bottom level are original images
-        x1_pyramid = self.feature_pyramid_extractor(x1_raw) + [x1_raw]
-        x2_pyramid = self.feature_pyramid_extractor(x2_raw) + [x2_raw]
+    def decode(self, x1_pyramid, x2_pyramid, training=False, output_level=None):
+        """
+        coarse-to-fine flow from precomputed pyramids of both frames
+            output_level: pyramid level to stop at, None for self.output_level,
+                          the context network only refines the flow at self.output_level
+        """
+        x1_raw = x1_pyramid[-1]
+        output_level = self.output_level if output_level is None else min(output_level, self.output_level)
 
         # outputs
         flows = []
 
         # init
         b_size, _, h_x1, w_x1, = self.shape(x1_pyramid[0])
-        flow = self.zeros((b_size, 2, h_x1, w_x1), mindspore.float32)
+        flow = self.zeros((b_size, 2, h_x1, w_x1), x1_pyramid[0].dtype)
 
         for l, (x1, x2) in enumerate(zip(x1_pyramid, x2_pyramid)):
 
@@ -96,10 +95,7 @@ class PWCNet(nn.Cell):
                 flow = upsample2d_as(flow, x1)
                 x2_warp = self.warping_layer(x2, flow)
 
-            x1_ = self.transpose(x1, (0, 2, 3, 1))
-            x2_warp = self.transpose(x2_warp, (0, 2, 3, 1))
-            out_corr = self.cost_volume(x1_, x2_warp)
-            out_corr = self.transpose(out_corr, (0, 3, 1, 2))
+            out_corr = self.cost_volume(x1, x2_warp)
             out_corr_relu = self.leakyRELU(out_corr)
 
             # flow estimator
@@ -111,6 +107,8 @@ class PWCNet(nn.Cell):
             # upsampling or post-processing
             if l != self.output_level:
                 flows.append(flow)
+                if l == output_level:
+                    break
             else:
                 flow_res = self.context_networks(self.concat2((x_intm, flow)))
                 flow = flow + flow_res
@@ -135,3 +133,28 @@ class BuildTrainNetwork(nn.Cell):
         result = self.network(x1_raw, x2_raw)
         loss = self.criterion(result, target)
         return loss
+
+
+if __name__ == '__main__':
+    # parity of the batched cost volume with the per-displacement loop on NHWC
+    import numpy as np
+
+    def cost_volume_loop(x1, x2_warp, search_range=4):
+        x1 = P.transpose(x1, (0, 2, 3, 1))
+        padded_lvl = P.Pad(((0, 0), (search_range, search_range), (search_range, search_range), (0, 0)))(
+            P.transpose(x2_warp, (0, 2, 3, 1)))
+        _, h, w, _ = x1.shape
+        max_offset = search_range * 2 + 1
+        cost_vol = []
+        for y in range(0, max_offset):
+            for x in range(0, max_offset):
+                slice_ = padded_lvl[:, y : y + h, x : x + w, :]
+                cost_vol.append(P.ReduceMean(keep_dims=True)(x1 * slice_, 3))
+        return P.transpose(P.Concat(3)(cost_vol), (0, 3, 1, 2))
+
+    net = PWCNet()
+    x1 = mindspore.Tensor(np.random.randn(2, 16, 12, 20).astype(np.float32))
+    x2 = mindspore.Tensor(np.random.randn(2, 16, 12, 20).astype(np.float32))
+    diff = np.abs(net.cost_volume(x1, x2).asnumpy() - cost_volume_loop(x1, x2).asnumpy()).max()
+    print('cost volume max abs diff: {:.3e}'.format(diff))
+    assert diff < 1e-5, diff
@@ -0,0 +1,112 @@
+"""
+Disk cache of frozen teacher outputs
+
+Entries are content addressed: the file name is a hash of the teacher fingerprint (its parameters)
+and of the sample key (sample id, crop window, time index, patch size),
+so another teacher or another crop never reads a stale entry. One .npy file per sample.
+The cache directory is kept under a byte budget, the oldest entries are removed first.
+"""
+
+import os
+import hashlib
+from collections import OrderedDict
+
+import numpy as np
+
+from utils.utils_cache import atomic_save
+
+
+def fingerprint(net):
+    """hash of the parameter names and values of a network"""
+    h = hashlib.sha1()
+    for name, param in net.parameters_and_names():
+        h.update(name.encode())
+        h.update(np.ascontiguousarray(param.asnumpy()).tobytes())
+    return h.hexdigest()[:16]
+
+
+class TeacherCache:
+    """
+    Parameters:
+        cache_dir: root directory of the entries, shared by runs with the same teacher
+        namespace: teacher fingerprint, entries of other namespaces are never hit
+        dtype: storage dtype of the outputs
+        max_bytes: budget of the whole cache_dir, None for no limit
+
+    get_batch returns the stacked outputs of all keys or None if any one is missing.
+    """
+
+    def __init__(self, cache_dir, namespace, dtype=np.float32, max_bytes=None):
+        self.cache_dir = cache_dir
+        self.namespace = namespace
+        self.dtype = np.dtype(dtype)
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        os.makedirs(cache_dir, exist_ok=True)
+        self.entries = self._scan()  # path -> size, oldest first
+        self.nbytes = sum(self.entries.values())
+
+    def _scan(self):
+        entries = []
+        for root, _, files in os.walk(self.cache_dir):
+            for name in files:
+                if name.endswith('.npy') and '.tmp' not in name:
+                    path = os.path.join(root, name)
+                    stat = os.stat(path)
+                    entries.append((stat.st_mtime, path, stat.st_size))
+        return OrderedDict((path, size) for _, path, size in sorted(entries))
+
+    def _path(self, key):
+        digest = hashlib.sha1(repr((self.namespace,) + tuple(key)).encode()).hexdigest()
+        return os.path.join(self.cache_dir, digest[:2], digest + '.npy')
+
+    def _evict(self, nbytes):
+        """remove the oldest entries until nbytes more fit in the budget"""
+        while self.entries and self.nbytes + nbytes > self.max_bytes:
+            path, size = self.entries.popitem(last=False)
+            self.nbytes -= size
+            self.evictions += 1
+            try:
+                os.remove(path)
+            except FileNotFoundError:  # removed by another run
+                pass
+
+    def get(self, key):
+        path = self._path(key)
+        if not os.path.exists(path):
+            return None
+        return np.load(path)
+
+    def put(self, key, value):
+        value = np.asarray(value, dtype=self.dtype)
+        if self.max_bytes is not None:
+            if value.nbytes > self.max_bytes:
+                return
+            self._evict(value.nbytes)
+        path = self._path(key)
+        atomic_save(path, lambda tmp_path: np.save(tmp_path, value))
+        size = os.path.getsize(path)
+        self.nbytes += size - self.entries.pop(path, 0)  # an overwritten entry is counted once
+        self.entries[path] = size
+
+    def get_batch(self, keys):
+        values = []
+        for key in keys:
+            value = self.get(key)
+            if value is None:
+                self.misses += 1
+                return None
+            values.append(value)
+        self.hits += 1
+        return np.stack(values, 0).astype(np.float32)
+
+    def put_batch(self, keys, values):
+        for key, value in zip(keys, values):
+            self.put(key, value)
+
+    def info(self):
+        """batch hits and misses, size of the cache"""
+        return {'hits': self.hits, 'misses': self.misses, 'hit_rate': self.hits / max(self.hits + self.misses, 1),
+                'bytes': self.nbytes, 'evictions': self.evictions}
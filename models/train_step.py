@@ -0,0 +1,132 @@
+"""
+Training step built once: forward, loss, gradients and optimizer update of one iteration
+
+TrainStepCell holds the loss cell, its gradients and the optimizer update in one nn.Cell.
+In jit mode it is compiled with ms.jit, one graph per input signature (shapes and dtypes, static within
+a run as the train batches are dropped to a fixed size). Everything the step touches has to be built
+before the first call, sub-networks and losses are cells and no Python-side state is read or written inside.
+If compilation fails the step falls back to PyNative for the rest of the run and logs a warning.
+"""
+
+import os
+import re
+import time
+import logging
+
+import mindspore as ms
+import mindspore.nn as nn
+import mindspore.ops as O
+
+
+logger = logging.getLogger(__name__)
+
+
+def enable_compile_cache(cache_dir):
+    """persistent compile cache, later runs load the compiled graphs from cache_dir instead of recompiling"""
+    os.makedirs(cache_dir, exist_ok=True)
+    ms.set_context(enable_compile_cache=True, compile_cache_path=cache_dir)
+
+
+def failing_op(error):
+    """primitive named in a MindSpore error message ("For 'Op', ..."), else the first line of the message"""
+    text = str(error)
+    match = re.search(r"For '([\w.]+)'", text)
+    if match:
+        return match.group(1)
+    return text.splitlines()[0] if text else type(error).__name__
+
+
+class TrainStepCell(nn.Cell):
+    """
+    Parameters:
+        loss_net: cell, loss_net(*inputs) -> (loss, aux), aux is a tuple of tensors
+        optimizer: optimizer cell, the gradients are taken w.r.t. optimizer.parameters
+
+    construct runs one step and returns (loss, aux).
+    """
+
+    def __init__(self, loss_net, optimizer):
+        super(TrainStepCell, self).__init__(auto_prefix=False)  # keep the parameter names of the wrapped nets
+        self.loss_net = loss_net
+        self.optimizer = optimizer
+        self.weights = optimizer.parameters
+
+    def construct(self, *inputs):
+        (loss, aux), grads = O.value_and_grad(self.loss_net, None, self.weights, has_aux=True)(*inputs)
+        loss = O.depend(loss, self.optimizer(grads))
+        return loss, aux
+
+
+class TrainStep:
+    """
+    Parameters:
+        loss_net: cell, loss_net(*inputs) -> (loss, aux), a function of the batch tensors only
+        optimizer: optimizer cell, the gradients are taken w.r.t. optimizer.parameters
+        jit: compile the step with ms.jit, otherwise run it in PyNative
+        max_signatures: input signatures compiled before the step falls back to PyNative,
+                        guards against recompiling every iteration on dynamic shapes
+
+    Calling it runs one step and returns (loss, aux).
+    compiles / compile_time / graph_steps / fallback report what happened.
+    """
+
+    def __init__(self, loss_net, optimizer, jit=True, max_signatures=4):
+        self.cell = TrainStepCell(loss_net, optimizer)
+        self.jit = jit
+        self.max_signatures = max_signatures
+        self.graphs = {}  # input signature -> compiled step
+        self.compiles = 0
+        self.compile_time = 0.
+        self.graph_steps = 0  # steps run by a compiled graph
+        self.fallback = None
+
+    def step(self, *inputs):
+        return self.cell(*inputs)
+
+    def compile(self):
+        cell = self.cell
+
+        def run(*inputs):
+            return cell(*inputs)
+        return ms.jit(run)
+
+    @staticmethod
+    def signature(inputs):
+        return tuple((tuple(x.shape), str(x.dtype)) for x in inputs)
+
+    def _disable_jit(self, reason, error=None):
+        self.jit = False
+        self.fallback = reason
+        if error is None:
+            logger.warning('TrainStep falls back to PyNative: %s', reason)
+        else:
+            logger.warning('TrainStep falls back to PyNative, compiling the step failed at %s (%s):\n%s',
+                           reason, type(error).__name__, error)
+
+    def __call__(self, *inputs):
+        if not self.jit:
+            return self.step(*inputs)
+        key = self.signature(inputs)
+        graph = self.graphs.get(key)
+        if graph is not None:
+            self.graph_steps += 1
+            return graph(*inputs)
+        if len(self.graphs) >= self.max_signatures:
+            self._disable_jit('more than {} input signatures'.format(self.max_signatures))
+            return self.step(*inputs)
+        graph = self.compile()
+        t = time.time()
+        try:
+            outputs = graph(*inputs)
+        except Exception as e:  # graph-mode parse, type inference and compile errors have no common type
+            self._disable_jit(failing_op(e), e)
+            return self.step(*inputs)
+        self.compile_time += time.time() - t  # first call, compilation and one step
+        self.compiles += 1
+        self.graph_steps += 1
+        self.graphs[key] = graph
+        return outputs
+
+    def info(self):
+        return {'jit': self.jit, 'compiles': self.compiles, 'compile_time': self.compile_time,
+                'graph_steps': self.graph_steps, 'fallback': self.fallback}
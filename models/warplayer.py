@@ -1,23 +1,92 @@
+import numpy as np
 import mindspore as ms
 import mindspore.nn as nn
 import mindspore.ops as O
-from .ms_tensor_utils import m_t_tensor_convert
+from mindspore.ops import constexpr
+from collections import OrderedDict
+
+
+class GridCache:
+    """
+    normalized base grids in [-1, 1] (align_corners=True) and the pixel-to-normalized flow scales,
+    keyed by (H, W, dtype), LRU evicted beyond max_bytes
+
+    The lookup is only reached through base_grid, which runs it in Python (PyNative) or once at compile
+    time (ms.jit), so the bookkeeping never becomes part of a compiled graph.
+    """
+
+    def __init__(self, max_bytes=64 << 20):
+        self.max_bytes = max_bytes
+        self.grids = OrderedDict()
+        self.nbytes = 0
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, h, w, dtype=ms.float32):
+        """returns grid: (1, 2, h, w), scale: (1, 2, 1, 1)"""
+        key = (h, w, dtype)
+        if key in self.grids:
+            self.hits += 1
+            self.grids.move_to_end(key)
+            return self.grids[key]
+        self.misses += 1
+        tenHorizontal = np.broadcast_to(np.linspace(-1.0, 1.0, w).reshape(1, 1, 1, w), (1, 1, h, w))
+        tenVertical = np.broadcast_to(np.linspace(-1.0, 1.0, h).reshape(1, 1, h, 1), (1, 1, h, w))
+        grid = ms.Tensor(np.concatenate([tenHorizontal, tenVertical], 1), dtype)
+        scale = ms.Tensor([2.0 / max(w - 1, 1), 2.0 / max(h - 1, 1)], dtype).view(1, 2, 1, 1)
+        self.grids[key] = (grid, scale)
+        self.nbytes += grid.nbytes
+        while self.nbytes > self.max_bytes and len(self.grids) > 1:
+            _, (old, _) = self.grids.popitem(last=False)
+            self.nbytes -= old.nbytes
+        return grid, scale
+
+    def clear(self):
+        self.grids.clear()
+        self.nbytes = 0
+
+    def info(self):
+        return {'entries': len(self.grids), 'bytes': self.nbytes, 'hits': self.hits, 'misses': self.misses}
+
+
+grid_cache = GridCache()
+
+
+@constexpr
+def base_grid(h, w, dtype):
+    """grid_cache entry of (h, w, dtype), a graph constant under ms.jit"""
+    return grid_cache.get(h, w, dtype)
+
+
+def flow_grid(tenFlow):
+    """sampling grid of grid_sample (align_corners=True) for a pixel flow [B, 2, H, W], returns [B, H, W, 2]"""
+    grid, scale = base_grid(tenFlow.shape[2], tenFlow.shape[3], tenFlow.dtype)
+    return (grid + tenFlow * scale).permute(0, 2, 3, 1)
+
+
+def masked_warp(x, flo):
+    """
+    warp an image/tensor (im2) back to im1, according to the optical flow, zero where the
+    bilinear footprint leaves the image
+        x: [B, C, H, W] (im2)
+        flo: [B, 2, H, W] flow
+    returns: output [B, C, H, W], mask [B, 1, H, W]
+    """
+    H, W = x.shape[2], x.shape[3]
+    vgrid = flow_grid(flo)
+    output = O.grid_sample(x, vgrid, padding_mode='border')
+    # in-bounds weight of sampling a ones image with zero padding (align_corners=False),
+    # per axis 1 - the part of the bilinear footprint outside [0, size-1]
+    ix = ((vgrid[..., 0] + 1) * W - 1) / 2
+    iy = ((vgrid[..., 1] + 1) * H - 1) / 2
+    mx = O.clamp(1 - O.relu(-ix) - O.relu(ix - (W - 1)), 0, 1)
+    my = O.clamp(1 - O.relu(-iy) - O.relu(iy - (H - 1)), 0, 1)
+    mask = ((mx * my) >= 0.999).astype(x.dtype).unsqueeze(1)
+    return output * mask, mask
 
-backwarp_tenGrid = {}
 
 def warp(tenInput, tenFlow, device='cuda'):
-    k = (str(tenFlow.shape))
-    if k not in backwarp_tenGrid:
-        tenHorizontal = O.linspace(-1.0, 1.0, tenFlow.shape[3]).view(
-            1, 1, 1, tenFlow.shape[3]).broadcast_to((tenFlow.shape[0], -1, tenFlow.shape[2], -1))
-        tenVertical = O.linspace(-1.0, 1.0, tenFlow.shape[2]).view(
-            1, 1, tenFlow.shape[2], 1).broadcast_to((tenFlow.shape[0], -1, -1, tenFlow.shape[3]))
-        backwarp_tenGrid[k] = O.cat([tenHorizontal, tenVertical], 1)
-
-    tenFlow = O.cat([tenFlow[:, 0:1, :, :] / ((tenInput.shape[3] - 1.0) / 2.0),
-                         tenFlow[:, 1:2, :, :] / ((tenInput.shape[2] - 1.0) / 2.0)], 1)
-
-    g = (backwarp_tenGrid[k] + tenFlow).permute(0, 2, 3, 1)
+    g = flow_grid(tenFlow)
     return O.grid_sample(input=tenInput, grid=O.clamp(g, -1, 1), mode='bilinear',
                          padding_mode='zeros', align_corners=True)
 
@@ -25,9 +94,14 @@ def multi_warp(img, flows, device='cuda'):
     return multi_backward_warp(img, flows, device)
 
 def multi_backward_warp(img, flows, device='cuda'):
+    """
+    warp img with several flows in one grid_sample, the flow index is folded into the batch
+        img: [B, C, H, W]
+        flows: [B, 2*n, H, W]
+    returns: [B, n*C, H, W], the C channels warped by flow i at [i*C, (i+1)*C)
+    """
+    B, C, H, W = img.shape
     num_flows = int(flows.shape[1] // 2)
-    warped_imgs = []
-    for i in range(num_flows):
-        warped_imgs.append(warp(img, flows[:, 2 * i:2 * (i + 1)], device))
-    warped_imgs = O.cat(warped_imgs, axis=1)
-    return warped_imgs
+    imgs = img.unsqueeze(1).broadcast_to((B, num_flows, C, H, W)).reshape(B * num_flows, C, H, W)
+    warped_imgs = warp(imgs, flows.reshape(B * num_flows, 2, H, W), device)
+    return warped_imgs.reshape(B, num_flows * C, H, W)
@@ -0,0 +1,31 @@
+import os
+
+
+'''
+# --------------------------------------------
+# on-disk caches
+# --------------------------------------------
+'''
+
+
+def cache_path(*names):
+    """path under the cache root SELFDRSC_CACHE_DIR, ~/.cache/selfdrsc by default"""
+    root = os.environ.get('SELFDRSC_CACHE_DIR', os.path.join(os.path.expanduser('~'), '.cache', 'selfdrsc'))
+    return os.path.join(root, *names)
+
+
+def atomic_save(path, save_fn):
+    """
+    save_fn(tmp_path) writes the file next to path, it is then renamed to path in one step,
+    readers never see a partial file and concurrent writers of the same entry are harmless
+    the temporary name keeps the extension of path, for savers that append a missing one
+    """
+    root, ext = os.path.splitext(path)
+    os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+    tmp_path = '{}.{}.tmp{}'.format(root, os.getpid(), ext)
+    try:
+        save_fn(tmp_path)
+        os.replace(tmp_path, path)
+    finally:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
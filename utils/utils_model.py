@@ -1,5 +1,6 @@
 # -*- coding: utf-8 -*-
 import numpy as np
+import mindspore as ms
 import mindspore.nn as nn
 import mindspore.ops as O
 from utils import utils_image as util
@@ -145,3 +146,72 @@ def test_split_x8(model, L, refield=32, min_size=256, sf=1, modulo=1):
     output_cat = O.stack(E_list, dim=0)
     E = output_cat.mean(dim=0, keepdim=False)
     return E
+
+
+'''
+# --------------------------------------------
+# tiled dual input (RS pair + time code)
+# --------------------------------------------
+'''
+
+
+def tile_starts(size, tile, overlap):
+    """start offsets of tiles covering [0, size), the last tile is aligned to the end"""
+    if size <= tile:
+        return [0]
+    starts = list(range(0, size - tile, tile - overlap))
+    return starts + [size - tile]
+
+
+def feather_weights(tile_h, tile_w, overlap):
+    """linear ramps over the overlap at every tile side, strictly positive"""
+    def _ramp(n):
+        if overlap <= 0:
+            return np.ones(n, dtype=np.float32)
+        ramp = np.minimum(np.arange(1, n + 1), np.arange(n, 0, -1)) / (overlap + 1.)
+        return np.minimum(ramp, 1.).astype(np.float32)
+    return _ramp(tile_h)[:, None] * _ramp(tile_w)[None, :]
+
+
+def test_tile(model, L, encoding, tile=256, overlap=32, tile_batch=1, modulo=32, pad_mode='replicate'):
+    """
+    Args:
+        model: RSG-like model, model(L, encoding) -> (E, flows)
+        L: (b, 2, 3, h, w) dual RS images
+        encoding: (b, c, h, w) or (b, n, c, h, w) full-frame time encodings
+        tile: tile size, a multiple of modulo
+        overlap: overlap of neighbouring tiles, blended with feathered weights
+        tile_batch: number of tiles stacked along the batch axis per model call
+        modulo: size multiple required by the model, tiles smaller than that are padded
+        pad_mode: padding mode of undersized tiles
+
+    Returns:
+        E: estimated result of shape (b, c_out, h, w) or (b, n, c_out, h, w), blended on the host
+        so that device memory only depends on the tile size
+    """
+    assert tile % modulo == 0, 'tile {} is not a multiple of {}'.format(tile, modulo)
+    assert 0 <= overlap < tile, overlap
+    b = L.shape[0]
+    h, w = L.shape[-2:]
+    boxes = [(top, left, min(tile, h), min(tile, w)) for top in tile_starts(h, tile, overlap)
+             for left in tile_starts(w, tile, overlap)]
+
+    E, weight = None, np.zeros((h, w), dtype=np.float32)
+    for i in range(0, len(boxes), tile_batch):
+        batch = boxes[i:i + tile_batch]
+        th, tw = batch[0][2], batch[0][3]
+        Ls = O.cat([L[..., top:top + th, left:left + tw] for top, left, _, _ in batch], axis=0)
+        encs = O.cat([encoding[..., top:top + th, left:left + tw] for top, left, _, _ in batch], axis=0)
+        ph, pw = -th % modulo, -tw % modulo
+        if ph or pw:
+            Ls = O.pad(Ls.reshape(-1, 3, th, tw), (0, pw, 0, ph), mode=pad_mode).reshape(Ls.shape[:-2] + (th + ph, tw + pw))
+            encs = O.pad(encs.reshape(-1, 1, th, tw), (0, pw, 0, ph), mode=pad_mode).reshape(encs.shape[:-2] + (th + ph, tw + pw))
+        Es, _ = model(Ls, encs)
+        Es = Es[..., :th, :tw].asnumpy()
+        if E is None:
+            E = np.zeros((b,) + Es.shape[1:-2] + (h, w), dtype=np.float32)
+        wmap = feather_weights(th, tw, overlap)
+        for k, (top, left, _, _) in enumerate(batch):
+            E[..., top:top + th, left:left + tw] += Es[k * b:(k + 1) * b] * wmap
+            weight[top:top + th, left:left + tw] += wmap
+    return ms.Tensor(E / weight)
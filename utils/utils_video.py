@@ -0,0 +1,167 @@
+# -*- coding: utf-8 -*-
+import queue
+import threading
+import time
+import cv2
+import numpy as np
+
+
+'''
+# --------------------------------------------
+# dual RS frame sources
+# --------------------------------------------
+'''
+
+
+def video_frames(path):
+    """yield BGR uint8 frames (HxWx3) of a video file"""
+    cap = cv2.VideoCapture(path)
+    if not cap.isOpened():
+        raise IOError('Cannot open video {}.'.format(path))
+    try:
+        while True:
+            success, img = cap.read()
+            if not success:
+                break
+            yield img
+    finally:
+        cap.release()
+
+
+def video_fps(path):
+    cap = cv2.VideoCapture(path)
+    fps = cap.get(cv2.CAP_PROP_FPS)
+    cap.release()
+    return fps
+
+
+def dual_video_frames(t2b_path, b2t_path):
+    """yield (t2b, b2t) frame pairs of two synchronized videos, stops at the shorter one"""
+    for t2b, b2t in zip(video_frames(t2b_path), video_frames(b2t_path)):
+        assert t2b.shape == b2t.shape, '{} != {}'.format(t2b.shape, b2t.shape)
+        yield t2b, b2t
+
+
+'''
+# --------------------------------------------
+# streaming RS correction
+# decode -> inference -> encode, with bounded queues in between
+# --------------------------------------------
+'''
+
+
+class VideoSink:
+    """GS frame writer opening the encoder on the first frame"""
+
+    def __init__(self, path, fps, fourcc='mp4v'):
+        self.path = path
+        self.fps = fps
+        self.fourcc = fourcc
+        self.writer = None
+        self.num_frames = 0
+
+    def write(self, img):
+        if self.writer is None:
+            h, w = img.shape[:2]
+            self.writer = cv2.VideoWriter(self.path, cv2.VideoWriter_fourcc(*self.fourcc), self.fps, (w, h))
+            if not self.writer.isOpened():
+                raise IOError('Cannot open video writer {}.'.format(self.path))
+        self.writer.write(img)
+        self.num_frames += 1
+
+    def close(self):
+        if self.writer is not None:
+            self.writer.release()
+
+
+class StreamPipeline:
+    """
+    Args:
+        infer_fn: maps a uint8 batch of dual RS frames (b, 2, h, w, 3) to uint8 GS frames (b, n, h, w, 3)
+        batch_size: number of RS pairs per inference call
+        queue_size: capacity of the decode and encode queues, in batches
+    """
+
+    _END = object()
+
+    def __init__(self, infer_fn, batch_size=1, queue_size=4):
+        self.infer_fn = infer_fn
+        self.batch_size = batch_size
+        self.queue_size = queue_size
+        self.stats = {}
+
+    def _decode(self, source, q_in, errors):
+        try:
+            batch = []
+            for t2b, b2t in source:
+                batch.append(np.stack((t2b, b2t), axis=0))
+                if len(batch) == self.batch_size:
+                    q_in.put(np.stack(batch, axis=0))
+                    batch = []
+            if batch:
+                q_in.put(np.stack(batch, axis=0))
+        except Exception as e:
+            errors.append(e)
+        finally:
+            q_in.put(self._END)
+
+    def _encode(self, sink, q_out, errors):
+        try:
+            while True:
+                frames = q_out.get()
+                if frames is self._END:
+                    break
+                for pair_frames in frames:
+                    for img in pair_frames:
+                        sink.write(img)
+        except Exception as e:
+            errors.append(e)
+            # keep draining so the inference stage never blocks on a dead encoder
+            while q_out.get() is not self._END:
+                pass
+
+    def run(self, source, sink):
+        """
+        Args:
+            source: iterable of (t2b, b2t) BGR uint8 frames, e.g. dual_video_frames
+            sink: object with write(img) and close(), e.g. VideoSink
+        Returns:
+            stats: number of pairs, wall time and time spent waiting for decoded frames
+        """
+        q_in = queue.Queue(maxsize=self.queue_size)
+        q_out = queue.Queue(maxsize=self.queue_size)
+        errors = []
+        decoder = threading.Thread(target=self._decode, args=(source, q_in, errors), daemon=True)
+        encoder = threading.Thread(target=self._encode, args=(sink, q_out, errors), daemon=True)
+        decoder.start()
+        encoder.start()
+
+        num_pairs, wait_time, infer_time = 0, 0., 0.
+        time_start = time.time()
+        try:
+            while not errors:
+                t = time.time()
+                rs = q_in.get()
+                wait_time += time.time() - t
+                if rs is self._END:
+                    break
+                t = time.time()
+                q_out.put(self.infer_fn(rs))
+                infer_time += time.time() - t
+                num_pairs += rs.shape[0]
+        finally:
+            q_out.put(self._END)
+            encoder.join()
+            sink.close()
+            # unblock the decoder if inference stopped early
+            while decoder.is_alive():
+                try:
+                    q_in.get(timeout=0.1)
+                except queue.Empty:
+                    pass
+        if errors:
+            raise errors[0]
+
+        self.stats = {'pairs': num_pairs, 'time': time.time() - time_start,
+                      'infer_time': infer_time, 'decode_wait': wait_time}
+        return self.stats